@@ -1,9 +1,20 @@
-from flask import Flask, request, jsonify, send_file
-from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
+from flask import Flask, request, jsonify
+from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
 from models import init_db
 from auth import authenticate_user, register_user
 from swapper_images import init_swapper_table, add_swapper_image, get_all_swapper_images, delete_swapper_image, get_swapper_image_by_id
-from cinemas import init_cinemas_table, add_cinema, get_all_cinemas, get_cinema_by_id, update_cinema, delete_cinema, search_cinemas
+from cinemas import init_cinemas_table, add_cinema, get_all_cinemas, get_cinema_by_id, update_cinema, delete_cinema, search_cinemas, get_cinema_facets, get_cinemas_by_ids
+from cinema_suggest import load_suggest_index, suggest_index, DEFAULT_SUGGEST_LIMIT
+from cinema_similarity import load_similarity_index, refresh_similarity_index, similarity_index, DEFAULT_SIMILAR_LIMIT
+from file_delivery import send_upload_file
+from idempotency import init_idempotency_table, idempotent
+from image_hash import compute_phash, hash_index, load_hash_index
+from feed import build_feed, FEED_SECTIONS
+from singleflight import read_coalescer
+from serialization import api_response
+from upload_reconciler import reconcile_status
 import os
 import uuid
 from werkzeug.utils import secure_filename
@@ -19,6 +30,26 @@ app.config['UPLOAD_FOLDER'] = 'uploads/swapper'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB 最大文件大小
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
 
+# 近似重复图片检测（感知哈希）
+# reject: 拒绝上传并返回已有图片; link: 不保存新文件，直接返回已有图片; off: 不检测
+app.config['SWAPPER_DUPLICATE_MODE'] = 'reject'
+app.config['SWAPPER_DUPLICATE_THRESHOLD'] = 6  # 汉明距离阈值(64位)
+
+# 图片分发配置
+# send_file: Flask直接返回(gunicorn下经file_wrapper调用os.sendfile);
+# x-accel-redirect / x-sendfile: 由前置代理(nginx/Apache)传输文件，Python只负责查询和鉴权
+app.config['SWAPPER_DELIVERY_MODE'] = os.environ.get('SWAPPER_DELIVERY_MODE', 'send_file')
+app.config['SWAPPER_ACCEL_PREFIX'] = '/protected/swapper/'  # nginx internal location
+app.config['SWAPPER_CACHE_MAX_AGE'] = 86400  # 图片缓存时间(秒)
+
+# 幂等键配置（请求头 Idempotency-Key）
+app.config['IDEMPOTENCY_TTL'] = 86400  # 保存结果的时间(秒)
+app.config['IDEMPOTENCY_WAIT_TIMEOUT'] = 10  # 并发重复请求的最长等待时间(秒)
+
+# 首页聚合接口配置
+app.config['FEED_TIMEOUT'] = 2.0  # 等待各分区的最长时间(秒)，超时的分区返回null
+app.config['FEED_CACHE_TTL'] = {'swapper': 60, 'cinemas': 10}  # 各分区缓存时间(秒)
+
 # 确保上传目录存在
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
@@ -30,12 +61,20 @@ print("正在初始化数据库...")
 init_db()
 init_swapper_table()
 init_cinemas_table()
+init_idempotency_table()
+load_suggest_index()
+load_similarity_index()
+load_hash_index()
 
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def valid_tags(tags):
+    """检查标签是否为字符串数组"""
+    return isinstance(tags, list) and all(isinstance(tag, str) for tag in tags)
+
 @app.route('/')
 def home():
     return jsonify({
@@ -46,6 +85,9 @@ def home():
                 '/api/register': '用户注册',
                 '/api/protected': '受保护的测试端点'
             },
+            '首页': {
+                '/api/feed': '首页聚合数据(轮播图/影院列表/用户信息)'
+            },
             '图片管理': {
                 '/api/swapper/images': '获取所有swapper图像',
                 '/api/swapper/upload': '上传swapper图像',
@@ -54,7 +96,10 @@ def home():
             '影院管理': {
                 '/api/cinemas': '获取所有影院/创建影院',
                 '/api/cinemas/<int:cinema_id>': '获取/更新/删除特定影院',
-                '/api/cinemas/search': '搜索影院'
+                '/api/cinemas/search': '搜索影院',
+                '/api/cinemas/facets': '影院筛选统计(标签计数/票价分布)',
+                '/api/cinemas/suggest': '影院名称/地址输入联想',
+                '/api/cinemas/<int:cinema_id>/similar': '相似影院推荐'
             }
         }
     })
@@ -94,6 +139,7 @@ def login():
         }), 500
 
 @app.route('/api/register', methods=['POST'])
+@idempotent
 def register():
     """用户注册接口"""
     try:
@@ -149,19 +195,62 @@ def protected():
         'current_user': current_user
     })
 
+# 首页聚合路由
+@app.route('/api/feed', methods=['GET'])
+def feed():
+    """首页聚合接口：一次返回轮播图、影院列表和（登录时）用户信息"""
+    try:
+        sections = request.args.get('sections')
+        sections = [name for name in sections.split(',') if name in FEED_SECTIONS] if sections else FEED_SECTIONS
+        limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+        offset = max(0, request.args.get('offset', 0, type=int))
+        
+        # 携带有效token时附带用户信息，未登录也可以访问
+        # token过期或无效时只有user分区为null，不影响其他分区
+        username = None
+        user_error = None
+        if 'user' in sections:
+            try:
+                if verify_jwt_in_request(optional=True):
+                    username = get_jwt_identity()
+            except (JWTExtendedException, PyJWTError) as e:
+                user_error = f'token无效: {str(e)}'
+        
+        data, errors = build_feed(
+            request.host_url.rstrip('/'), sections, limit, offset, username, app.config
+        )
+        if user_error:
+            data['user'] = None
+            errors['user'] = user_error
+        
+        result = {
+            'success': True,
+            'partial': bool(errors),
+            **data
+        }
+        if errors:
+            result['errors'] = errors
+        
+        return api_response(result)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取首页数据失败: {str(e)}'
+        }), 500
+
 # Swapper图像管理路由
 @app.route('/api/swapper/images', methods=['GET'])
 def get_swapper_images():
     """获取所有swapper图像"""
     try:
-        images = get_all_swapper_images()
-        
-        # 构建完整的URL
+        # 构建完整的URL（结果可能被并发请求共享，不在原对象上修改）
         base_url = request.host_url.rstrip('/')
-        for image in images:
-            image['imageURL'] = f"{base_url}/api/swapper/image/{image['id']}"
+        images = [
+            {**image, 'imageURL': f"{base_url}/api/swapper/image/{image['id']}"}
+            for image in get_all_swapper_images()
+        ]
         
-        return jsonify({
+        return api_response({
             'success': True,
             'images': images,
             'count': len(images)
@@ -174,6 +263,7 @@ def get_swapper_images():
 
 @app.route('/api/swapper/upload', methods=['POST'])
 @jwt_required()
+@idempotent
 def upload_swapper_image():
     """上传swapper图像"""
     try:
@@ -195,6 +285,44 @@ def upload_swapper_image():
         
         # 检查文件类型
         if file and allowed_file(file.filename):
+            base_url = request.host_url.rstrip('/')
+            
+            # 计算感知哈希并检查近似重复
+            phash = compute_phash(file.stream)
+            file.stream.seek(0)
+            
+            duplicate_mode = app.config['SWAPPER_DUPLICATE_MODE']
+            duplicate = None
+            if duplicate_mode != 'off':
+                # 图片可能已被其他进程（扫描、对账）删除，确认记录仍存在，否则从索引中移除后重新查找
+                while True:
+                    duplicate = hash_index.nearest(phash, app.config['SWAPPER_DUPLICATE_THRESHOLD'])
+                    if duplicate is None or get_swapper_image_by_id(duplicate[0]):
+                        break
+                    hash_index.remove(duplicate[0])
+            
+            if duplicate:
+                duplicate_id, distance = duplicate
+                duplicate_url = f"{base_url}/api/swapper/image/{duplicate_id}"
+                
+                if duplicate_mode == 'link':
+                    return jsonify({
+                        'success': True,
+                        'message': '图像与已有图像近似重复，已关联到已有图像',
+                        'image_id': duplicate_id,
+                        'imageURL': duplicate_url,
+                        'duplicate_of': duplicate_id,
+                        'distance': distance
+                    }), 200
+                
+                return jsonify({
+                    'success': False,
+                    'message': '图像与已有图像近似重复',
+                    'duplicate_of': duplicate_id,
+                    'imageURL': duplicate_url,
+                    'distance': distance
+                }), 409
+            
             # 生成安全的文件名
             filename = secure_filename(file.filename)
             # 添加UUID防止重名
@@ -204,11 +332,14 @@ def upload_swapper_image():
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
             file.save(file_path)
             
-            # 添加到数据库
-            image_id = add_swapper_image(file_path)
+            # 添加到数据库，失败时删除已保存的文件，避免留下孤立文件
+            try:
+                image_id = add_swapper_image(file_path, phash)
+            except Exception:
+                os.remove(file_path)
+                raise
             
             # 构建完整的访问URL
-            base_url = request.host_url.rstrip('/')
             image_url = f"{base_url}/api/swapper/image/{image_id}"
             
             return jsonify({
@@ -230,6 +361,7 @@ def upload_swapper_image():
         }), 500
 
 @app.route('/api/swapper/image/<int:image_id>', methods=['GET', 'DELETE'])
+@idempotent
 def swapper_image(image_id):
     """获取或删除特定swapper图像"""
     try:
@@ -244,7 +376,15 @@ def swapper_image(image_id):
                 }), 404
             
             # 返回图像文件
-            return send_file(image_info['imageURL'])
+            response = send_upload_file(image_info['imageURL'], app.config)
+            
+            if response is None:
+                return jsonify({
+                    'success': False,
+                    'message': '图像文件不存在'
+                }), 404
+            
+            return response
             
         elif request.method == 'DELETE':
             # 删除图像
@@ -272,6 +412,7 @@ def swapper_image(image_id):
 # 影院管理路由
 @app.route('/api/cinemas', methods=['GET', 'POST'])
 @jwt_required()
+@idempotent
 def cinemas():
     """获取所有影院或创建新影院"""
     try:
@@ -279,7 +420,7 @@ def cinemas():
             # 获取所有影院
             cinemas_list = get_all_cinemas()
             
-            return jsonify({
+            return api_response({
                 'success': True,
                 'cinemas': cinemas_list,
                 'count': len(cinemas_list)
@@ -318,11 +459,11 @@ def cinemas():
                     'message': '票价必须是有效的数字'
                 }), 400
             
-            # 验证标签是否为列表
-            if not isinstance(tags, list):
+            # 验证标签是否为字符串数组
+            if not valid_tags(tags):
                 return jsonify({
                     'success': False,
-                    'message': '标签必须是数组格式'
+                    'message': '标签必须是字符串数组'
                 }), 400
             
             # 添加影院
@@ -342,6 +483,7 @@ def cinemas():
 
 @app.route('/api/cinemas/<int:cinema_id>', methods=['GET', 'PUT', 'DELETE'])
 @jwt_required()
+@idempotent
 def cinema_detail(cinema_id):
     """获取、更新或删除特定影院"""
     try:
@@ -355,7 +497,7 @@ def cinema_detail(cinema_id):
                     'message': '影院不存在'
                 }), 404
             
-            return jsonify({
+            return api_response({
                 'success': True,
                 'cinema': cinema
             })
@@ -396,6 +538,13 @@ def cinema_detail(cinema_id):
                         'message': '票价必须是有效的数字'
                     }), 400
             
+            # 验证标签
+            if tags is not None and not valid_tags(tags):
+                return jsonify({
+                    'success': False,
+                    'message': '标签必须是字符串数组'
+                }), 400
+            
             # 更新影院
             success = update_cinema(cinema_id, name, address, price, tags)
             
@@ -431,6 +580,43 @@ def cinema_detail(cinema_id):
             'message': f'操作失败: {str(e)}'
         }), 500
 
+@app.route('/api/cinemas/<int:cinema_id>/similar', methods=['GET'])
+@jwt_required()
+def similar_cinemas_route(cinema_id):
+    """按标签和票价推荐相似影院"""
+    try:
+        k = request.args.get('k', DEFAULT_SIMILAR_LIMIT, type=int)
+        k = max(1, min(k, 50))
+        
+        refresh_similarity_index()
+        matches = similarity_index.similar(cinema_id, k)
+        if matches is None and refresh_similarity_index(force=True):
+            # 可能是其他worker新增的影院，索引重建后再查一次
+            matches = similarity_index.similar(cinema_id, k)
+        if matches is None:
+            return jsonify({
+                'success': False,
+                'message': '影院不存在'
+            }), 404
+        
+        scores = dict(matches)
+        cinemas_list = [
+            {**cinema, 'score': round(scores[cinema['id']], 4)}
+            for cinema in get_cinemas_by_ids([match_id for match_id, _ in matches])
+        ]
+        
+        return api_response({
+            'success': True,
+            'cinemas': cinemas_list,
+            'count': len(cinemas_list)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取相似影院失败: {str(e)}'
+        }), 500
+
 @app.route('/api/cinemas/search', methods=['GET'])
 def search_cinemas_route():
     """搜索影院"""
@@ -444,7 +630,7 @@ def search_cinemas_route():
         # 搜索影院
         cinemas_list = search_cinemas(keyword, min_price, max_price, tag)
         
-        return jsonify({
+        result = {
             'success': True,
             'cinemas': cinemas_list,
             'count': len(cinemas_list),
@@ -454,7 +640,13 @@ def search_cinemas_route():
                 'max_price': max_price,
                 'tag': tag
             }
-        })
+        }
+        
+        # 可选：同时返回筛选统计
+        if request.args.get('facets') == '1':
+            result['facets'] = get_cinema_facets(keyword, min_price, max_price, tag)
+        
+        return api_response(result)
         
     except Exception as e:
         return jsonify({
@@ -462,6 +654,49 @@ def search_cinemas_route():
             'message': f'搜索失败: {str(e)}'
         }), 500
 
+@app.route('/api/cinemas/facets', methods=['GET'])
+def cinema_facets_route():
+    """获取影院筛选统计：标签计数和票价分布"""
+    try:
+        keyword = request.args.get('keyword')
+        min_price = request.args.get('min_price', type=float)
+        max_price = request.args.get('max_price', type=float)
+        tag = request.args.get('tag')
+        
+        facets = get_cinema_facets(keyword, min_price, max_price, tag)
+        
+        return api_response({
+            'success': True,
+            'facets': facets,
+            'search_params': {
+                'keyword': keyword,
+                'min_price': min_price,
+                'max_price': max_price,
+                'tag': tag
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取筛选统计失败: {str(e)}'
+        }), 500
+
+@app.route('/api/cinemas/suggest', methods=['GET'])
+def suggest_cinemas_route():
+    """影院名称/地址输入联想（支持拼音和拼音首字母）"""
+    q = request.args.get('q', '')
+    limit = request.args.get('limit', DEFAULT_SUGGEST_LIMIT, type=int)
+    limit = max(1, min(limit, 50))
+    
+    suggestions = suggest_index.suggest(q, limit)
+    
+    return api_response({
+        'success': True,
+        'suggestions': suggestions,
+        'count': len(suggestions)
+    })
+
 # 调试端点
 @app.route('/api/debug/tables', methods=['GET'])
 def debug_tables():
@@ -497,6 +732,28 @@ def debug_tables():
             'message': f'检查表状态失败: {str(e)}'
         }), 500
 
+@app.route('/api/debug/coalescing', methods=['GET'])
+def debug_coalescing():
+    """调试端点：查看并发相同查询的合并统计"""
+    return jsonify({
+        'success': True,
+        'stats': read_coalescer.stats()
+    })
+
+@app.route('/api/debug/uploads', methods=['GET'])
+def debug_uploads():
+    """调试端点：查看上传目录的磁盘占用和对账结果"""
+    try:
+        return jsonify({
+            'success': True,
+            'uploads': reconcile_status(app.config['UPLOAD_FOLDER'])
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'获取上传目录状态失败: {str(e)}'
+        }), 500
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
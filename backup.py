@@ -0,0 +1,248 @@
+"""在线增量备份与恢复
+
+备份时在一个读事务内使用SQLite在线备份API分步复制数据库页（每步之间休眠以降低对请求的影响），
+然后根据备份出的数据库中的swapper_images记录生成上传文件清单并复制文件，
+保证数据库和上传文件处于同一时间点。
+
+用法:
+    python backup.py create [备份根目录]
+    python backup.py list [备份根目录]
+    python backup.py restore <快照目录>
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from database import DATABASE_PATH
+from cinema_similarity import SNAPSHOT_PATH as SIMILARITY_SNAPSHOT_PATH
+from file_delivery import normalize_upload_path
+
+BACKUP_ROOT = 'backups'
+# 每步复制的页数和步间休眠(秒)
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.005
+# 安全网：源库被修改导致备份从头开始的次数超过该值时改为一次性复制
+# （正常情况下备份期间持有读事务，不会重新开始）
+BACKUP_MAX_RESTARTS = 5
+# 复制上传文件的速率上限(字节/秒)，0表示不限速
+BACKUP_FILE_RATE_LIMIT = 20 * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+MANIFEST_NAME = 'manifest.json'
+SNAPSHOT_DB_NAME = 'database.db'
+SNAPSHOT_UPLOADS_DIR = 'uploads'
+
+class BackupRestarted(Exception):
+    """备份过程中源库被修改的次数过多"""
+
+def _backup_database(source_path, target_path, pages, sleep):
+    """分步复制数据库，每步之间休眠，返回 (步数, 重新开始次数)
+
+    Connection.backup的sleep参数只在遇到SQLITE_BUSY/LOCKED时生效，步间休眠在progress回调中完成。
+    源连接在整个备份期间持有一个WAL读事务，复制的是开始时刻的一致快照，
+    写线程的提交不会让备份从头开始。
+    """
+    state = {'steps': 0, 'restarts': 0, 'remaining': None}
+
+    def progress(status, remaining, total):
+        state['steps'] += 1
+        # 剩余页数变多说明备份从头开始了
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > BACKUP_MAX_RESTARTS:
+                raise BackupRestarted()
+        state['remaining'] = remaining
+        if remaining and sleep:
+            time.sleep(sleep)
+
+    source = sqlite3.connect(source_path, isolation_level=None)
+    target = sqlite3.connect(target_path)
+    try:
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except BackupRestarted:
+            # 写入频繁时改为一次性复制（WAL模式下不会阻塞写入）
+            source.backup(target, pages=-1)
+        source.execute('COMMIT')
+    finally:
+        target.close()
+        source.close()
+    return state['steps'], state['restarts']
+
+def _copy_file(source, target, rate_limit):
+    """限速复制文件并返回sha256"""
+    digest = hashlib.sha256()
+    started = time.monotonic()
+    copied = 0
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b''):
+            dst.write(chunk)
+            digest.update(chunk)
+            copied += len(chunk)
+            if rate_limit:
+                expected = copied / rate_limit
+                elapsed = time.monotonic() - started
+                if expected > elapsed:
+                    time.sleep(expected - elapsed)
+    shutil.copystat(source, target)
+    return digest.hexdigest()
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def create_snapshot(root=BACKUP_ROOT, database_path=DATABASE_PATH, pages=BACKUP_PAGES_PER_STEP,
+                    sleep=BACKUP_STEP_SLEEP, rate_limit=BACKUP_FILE_RATE_LIMIT):
+    """创建一个时间点快照，返回快照目录"""
+    started = time.perf_counter()
+    name = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    snapshot_dir = os.path.join(root, name)
+    temp_dir = snapshot_dir + '.partial'
+    os.makedirs(os.path.join(temp_dir, SNAPSHOT_UPLOADS_DIR))
+
+    snapshot_db = os.path.join(temp_dir, SNAPSHOT_DB_NAME)
+    steps, restarts = _backup_database(database_path, snapshot_db, pages, sleep)
+    database_seconds = time.perf_counter() - started
+
+    # 文件清单来自快照数据库本身，与数据库保持同一时间点
+    conn = sqlite3.connect(snapshot_db)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute('SELECT id, imageURL FROM swapper_images ORDER BY id').fetchall()
+    conn.close()
+
+    files = []
+    missing = []
+    for row in rows:
+        source = normalize_upload_path(row['imageURL'])
+        stored_name = f"{row['id']}_{os.path.basename(source)}"
+        try:
+            sha256 = _copy_file(source, os.path.join(temp_dir, SNAPSHOT_UPLOADS_DIR, stored_name), rate_limit)
+        except FileNotFoundError:
+            missing.append({'id': row['id'], 'path': row['imageURL']})
+            continue
+        files.append({
+            'id': row['id'],
+            'path': row['imageURL'],
+            'stored_as': stored_name,
+            'size': os.path.getsize(source),
+            'sha256': sha256
+        })
+
+    manifest = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'database': {
+            'file': SNAPSHOT_DB_NAME,
+            'size': os.path.getsize(snapshot_db),
+            'sha256': _file_sha256(snapshot_db),
+            'backup_steps': steps,
+            'backup_restarts': restarts,
+            'seconds': round(database_seconds, 3)
+        },
+        'files': files,
+        'missing_files': missing,
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+    with open(os.path.join(temp_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # 全部完成后再改名，中途失败不会留下看似完整的快照
+    os.replace(temp_dir, snapshot_dir)
+    return snapshot_dir, manifest
+
+def list_snapshots(root=BACKUP_ROOT):
+    """列出已完成的快照"""
+    if not os.path.isdir(root):
+        return []
+    snapshots = []
+    for name in sorted(os.listdir(root)):
+        manifest_path = os.path.join(root, name, MANIFEST_NAME)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                snapshots.append((os.path.join(root, name), json.load(f)))
+    return snapshots
+
+def _cinema_index_version(conn):
+    """读取影院数据版本号，表不存在时返回None"""
+    try:
+        row = conn.execute('SELECT version FROM cinema_index_version WHERE id = 1').fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+def restore_snapshot(snapshot_dir, database_path=DATABASE_PATH):
+    """从快照恢复数据库和上传文件，恢复前会校验快照完整性
+
+    恢复数据库时通过备份API写入，运行中的进程会在下一次查询时看到恢复后的数据，
+    但各进程的内存索引需要重启服务后才会重建。
+    恢复后影院数据版本号设为大于恢复前发放过的任何版本，并删除相似度索引快照，
+    避免恢复前的快照在版本号重新增长到相同数值后被当作最新数据加载。
+    """
+    with open(os.path.join(snapshot_dir, MANIFEST_NAME), encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    snapshot_db = os.path.join(snapshot_dir, manifest['database']['file'])
+    if _file_sha256(snapshot_db) != manifest['database']['sha256']:
+        raise ValueError('快照数据库校验失败')
+    for entry in manifest['files']:
+        stored = os.path.join(snapshot_dir, SNAPSHOT_UPLOADS_DIR, entry['stored_as'])
+        if _file_sha256(stored) != entry['sha256']:
+            raise ValueError(f"快照文件校验失败: {entry['stored_as']}")
+
+    restored_files = 0
+    for entry in manifest['files']:
+        target = normalize_upload_path(entry['path'])
+        if os.path.isfile(target) and os.path.getsize(target) == entry['size'] \
+                and _file_sha256(target) == entry['sha256']:
+            continue
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        shutil.copy2(os.path.join(snapshot_dir, SNAPSHOT_UPLOADS_DIR, entry['stored_as']), target)
+        restored_files += 1
+
+    source = sqlite3.connect(snapshot_db)
+    target = sqlite3.connect(database_path)
+    try:
+        previous_version = _cinema_index_version(target)
+        source.backup(target)
+        restored_version = _cinema_index_version(target)
+        if restored_version is not None:
+            target.execute('UPDATE cinema_index_version SET version = ? WHERE id = 1',
+                           (max(previous_version or 0, restored_version) + 1,))
+            target.commit()
+    finally:
+        target.close()
+        source.close()
+
+    try:
+        os.remove(SIMILARITY_SNAPSHOT_PATH)
+    except FileNotFoundError:
+        pass
+
+    return restored_files
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'create':
+        path, manifest = create_snapshot(*sys.argv[2:3])
+        print(f"快照已创建: {path}")
+        print(f"数据库 {manifest['database']['size'] / 1024:.0f}KB，{manifest['database']['backup_steps']} 步，"
+              f"重新开始 {manifest['database']['backup_restarts']} 次；"
+              f"文件 {len(manifest['files'])} 个，缺失 {len(manifest['missing_files'])} 个；"
+              f"耗时 {manifest['seconds']}s")
+    elif command == 'list':
+        for path, manifest in list_snapshots(*sys.argv[2:3]):
+            print(f"{path}  {manifest['created_at']}  文件 {len(manifest['files'])} 个")
+    elif command == 'restore' and len(sys.argv) > 2:
+        restored = restore_snapshot(sys.argv[2])
+        print(f"恢复完成，恢复上传文件 {restored} 个")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,431 @@
+"""性能基准测试
+
+在临时目录中运行，不会修改仓库中的数据库和上传目录。
+
+用法: python benchmark.py <场景>
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = tempfile.mkdtemp(prefix='qingwa_bench_')
+
+
+def load_app():
+    """在临时目录中导入应用（数据库和上传目录均为相对路径）"""
+    os.chdir(BENCH_DIR)
+    import app as app_module
+    return app_module
+
+
+def _worker_cpu_seconds(master_pid):
+    """gunicorn各worker进程已用的CPU时间(秒)，读取/proc，仅支持Linux"""
+    ticks = os.sysconf('SC_CLK_TCK')
+    total = 0.0
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # ppid是第4个字段，utime/stime是第14、15个字段（去掉pid和进程名后下标为1、11、12）
+        if int(fields[1]) == master_pid:
+            total += (int(fields[11]) + int(fields[12])) / ticks
+    return total
+
+
+def bench_delivery(concurrency=16, requests_per_mode=64, file_size=8 * 1024 * 1024):
+    """图片分发：在gunicorn(gthread)下比较各分发模式的吞吐量和worker的CPU占用
+
+    gunicorn提供wsgi.file_wrapper(os.sendfile)，与生产部署一致；需要安装gunicorn。
+    """
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        print("该场景需要gunicorn: pip install gunicorn")
+        sys.exit(1)
+    import subprocess
+    import urllib.request
+
+    app_module = load_app()
+    app = app_module.app
+
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'bench_large.jpg')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(file_size))
+    image_id = app_module.add_swapper_image(path)
+    url = f'http://127.0.0.1:8765/api/swapper/image/{image_id}'
+
+    print(f"并发: {concurrency}, 每种模式请求数: {requests_per_mode}, 文件大小: {file_size // 1024 // 1024}MB")
+    print(f"{'模式':<18}{'吞吐(req/s)':>14}{'平均延迟(ms)':>16}{'worker CPU(ms/req)':>20}{'响应体(MB)':>14}")
+
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    for mode in ('send_file', 'x-accel-redirect', 'x-sendfile'):
+        env = dict(os.environ, SWAPPER_DELIVERY_MODE=mode, PYTHONPATH=repo_dir)
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-k', 'gthread', '-w', '1', '--threads', str(concurrency),
+             '-b', '127.0.0.1:8765', 'app:app'],
+            cwd=BENCH_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            for _ in range(300):
+                try:
+                    urllib.request.urlopen(url).read()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            else:
+                raise RuntimeError('gunicorn启动失败')
+
+            latencies = []
+            sent = []
+            lock = threading.Lock()
+
+            def fetch(_):
+                start = time.perf_counter()
+                with urllib.request.urlopen(url) as response:
+                    body = response.read()
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    sent.append(len(body))
+
+            cpu_before = _worker_cpu_seconds(server.pid)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(fetch, range(requests_per_mode)))
+            total = time.perf_counter() - start
+            cpu = _worker_cpu_seconds(server.pid) - cpu_before
+        finally:
+            server.terminate()
+            server.wait()
+
+        # 没有前置代理时 x-accel-redirect / x-sendfile 只返回头部，体现的是Python侧的开销
+        print(f"{mode:<18}{requests_per_mode / total:>14.1f}"
+              f"{sum(latencies) / len(latencies) * 1000:>16.2f}"
+              f"{cpu / requests_per_mode * 1000:>20.2f}"
+              f"{sum(sent) / 1024 / 1024:>14.1f}")
+
+
+def bench_group_commit(writers=50, writes_per_writer=40):
+    """SQLite写入：比较每次写入单独提交与单写线程组提交的吞吐量和锁错误率"""
+    os.chdir(BENCH_DIR)
+    import sqlite3
+    import database
+    from models import init_db
+    init_db()
+
+    def direct_insert(i):
+        # 旧实现：每次写入独立连接并立即提交
+        conn = sqlite3.connect(database.DATABASE_PATH)
+        try:
+            conn.execute('INSERT INTO movie (title) VALUES (?)', (f'direct-{i}',))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def queued_insert(i):
+        database.execute_write('INSERT INTO movie (title) VALUES (?)', (f'queued-{i}',))
+
+    total_writes = writers * writes_per_writer
+    print(f"并发写入者: {writers}, 总写入数: {total_writes}")
+    print(f"{'方式':<14}{'写入/秒':>12}{'锁错误':>10}{'锁错误率':>12}")
+
+    for name, insert in (('独立提交', direct_insert), ('组提交', queued_insert)):
+        errors = []
+
+        def worker(w):
+            for n in range(writes_per_writer):
+                try:
+                    insert(w * writes_per_writer + n)
+                except sqlite3.OperationalError as e:
+                    errors.append(str(e))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+            list(pool.map(worker, range(writers)))
+        total = time.perf_counter() - start
+        ok = total_writes - len(errors)
+        print(f"{name:<14}{ok / total:>12.1f}{len(errors):>10}{len(errors) / total_writes:>12.2%}")
+
+    stats = database.get_db_writer().stats
+    print(f"组提交批次: {stats['batches']}, 平均每批操作数: {stats['operations'] / max(stats['batches'], 1):.1f}")
+
+
+def bench_suggest(cinema_count=100000, queries=20000):
+    """输入联想：10万家影院的索引内存占用、构建时间和查询延迟"""
+    import random
+    import tracemalloc
+    from cinema_suggest import PrefixIndex
+
+    random.seed(0)
+    brands = ['万达', '博纳', '星美', '金逸', '大地', '横店', 'CGV', '卢米埃', '耀莱', '中影']
+    districts = ['朝阳', '海淀', '浦东', '天河', '南山', '武侯', '西湖', '江北', '鼓楼', '雁塔']
+    cinemas = [
+        (i, f"{random.choice(brands)}影城（{random.choice(districts)}{i}店）",
+         f"{random.choice(districts)}区{random.randint(1, 999)}号{i}")
+        for i in range(cinema_count)
+    ]
+
+    index = PrefixIndex()
+    start = time.perf_counter()
+    index.build(cinemas)
+    build_time = time.perf_counter() - start
+
+    # 单独用tracemalloc再构建一次统计内存（tracemalloc会显著拖慢构建速度）
+    tracemalloc.start()
+    measured = PrefixIndex()
+    measured.build(cinemas)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del measured
+
+    prefixes = ['万', '万达', 'wd', 'wanda', 'bn', '朝阳', 'cgv', 'xm', '大地影城']
+    latencies = []
+    for n in range(queries):
+        prefix = prefixes[n % len(prefixes)]
+        start = time.perf_counter()
+        index.suggest(prefix, 10)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    start = time.perf_counter()
+    for i in range(1000):
+        index.add(cinema_count + i, f"新影城{i}", f"新地址{i}")
+    insert_time = (time.perf_counter() - start) / 1000
+
+    print(f"影院数: {cinema_count}, 检索键数: {len(index._keys)}")
+    print(f"构建时间: {build_time:.2f}s, 索引内存: {memory / 1024 / 1024:.1f}MB")
+    print(f"查询延迟: p50 {latencies[len(latencies) // 2] * 1e6:.1f}us, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.1f}us")
+    print(f"增量插入: 平均 {insert_time * 1e6:.1f}us")
+
+
+def bench_similar(cinema_count=100000, tag_count=200, queries=200):
+    """相似影院：10万家影院的索引构建、快照加载和top-k查询耗时"""
+    import random
+    from cinema_similarity import SimilarityIndex
+
+    random.seed(0)
+    vocabulary = [f'标签{i}' for i in range(tag_count)]
+    cinemas = [
+        (i, round(random.uniform(10, 200), 1), random.sample(vocabulary, random.randint(1, 6)))
+        for i in range(cinema_count)
+    ]
+
+    index = SimilarityIndex()
+    start = time.perf_counter()
+    index.build(cinemas, version=1)
+    build_time = time.perf_counter() - start
+
+    path = os.path.join(BENCH_DIR, 'similarity.npz')
+    start = time.perf_counter()
+    index.save(path)
+    save_time = time.perf_counter() - start
+    start = time.perf_counter()
+    SimilarityIndex().load(path, 1, cinema_count)
+    load_time = time.perf_counter() - start
+
+    latencies = []
+    for n in range(queries):
+        start = time.perf_counter()
+        index.similar(random.randrange(cinema_count), 10)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    print(f"影院数: {cinema_count}, 标签词表: {tag_count}, 标签位集: {index.tags.nbytes / 1024 / 1024:.1f}MB")
+    print(f"全量构建: {build_time:.2f}s, 写快照: {save_time:.2f}s "
+          f"({os.path.getsize(path) / 1024 / 1024:.1f}MB), 加载快照: {load_time:.2f}s")
+    print(f"top-10查询: p50 {latencies[len(latencies) // 2] * 1000:.2f}ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms")
+
+
+def bench_phash(image_count=50000, queries=1000):
+    """近似重复检测：5万张图片哈希索引的查询和全库扫描耗时"""
+    import numpy as np
+    from image_hash import HashIndex
+
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(-2 ** 63, 2 ** 63 - 1, image_count, dtype=np.int64).tolist()
+    index = HashIndex()
+    index.build(enumerate(hashes))
+
+    start = time.perf_counter()
+    for phash in hashes[:queries]:
+        index.nearest(phash)
+    query_time = (time.perf_counter() - start) / queries
+
+    start = time.perf_counter()
+    index.duplicate_groups()
+    scan_time = time.perf_counter() - start
+
+    print(f"图片数: {image_count}")
+    print(f"单次近似查询: {query_time * 1e6:.1f}us, 全库两两扫描: {scan_time:.2f}s")
+
+
+def bench_backup(cinema_count=200000, readers=4, baseline_seconds=2.0):
+    """在线备份：备份耗时，以及备份期间读写请求的延迟变化"""
+    import random
+    import database
+    import backup
+    from cinemas import init_cinemas_table, get_cinema_by_id, get_all_cinemas
+    from swapper_images import init_swapper_table
+
+    os.chdir(BENCH_DIR)
+    init_cinemas_table()
+    init_swapper_table()
+
+    def seed(cursor):
+        cursor.executemany(
+            'INSERT INTO cinemas (name, address, price, tags) VALUES (?, ?, ?, ?)',
+            ((f'影城{i}', f'地址{i}' * 10, 30 + i % 100, '["IMAX", "杜比"]') for i in range(cinema_count))
+        )
+    database.run_write(seed)
+    size_mb = os.path.getsize(database.DATABASE_PATH) / 1024 / 1024
+
+    def measure(action):
+        """在action执行期间持续发起读写请求，返回 (action结果, 读延迟列表, 写延迟列表)"""
+        stop = threading.Event()
+        read_latencies = []
+        write_latencies = []
+
+        def reader():
+            rng = random.Random()
+            while not stop.is_set():
+                start = time.perf_counter()
+                get_cinema_by_id(rng.randint(1, cinema_count))
+                get_all_cinemas(20, rng.randint(0, 1000))
+                read_latencies.append(time.perf_counter() - start)
+
+        def writer():
+            n = 0
+            while not stop.is_set():
+                start = time.perf_counter()
+                database.execute_write('UPDATE cinemas SET price = ? WHERE id = ?', (n % 100, n % cinema_count + 1))
+                write_latencies.append(time.perf_counter() - start)
+                n += 1
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=reader) for _ in range(readers)] + [threading.Thread(target=writer)]
+        for thread in threads:
+            thread.start()
+        result = action()
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return result, sorted(read_latencies), sorted(write_latencies)
+
+    def percentile(values, p):
+        return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0.0
+
+    phases = [
+        ('无备份', lambda: time.sleep(baseline_seconds)),
+        ('分步备份', lambda: backup.create_snapshot(os.path.join(BENCH_DIR, 'backups'))),
+        ('一次性备份', lambda: backup.create_snapshot(os.path.join(BENCH_DIR, 'backups'), pages=-1, sleep=0)),
+    ]
+
+    print(f"数据库大小: {size_mb:.1f}MB, 读线程: {readers}, 写入: 约100次/秒")
+    print(f"{'阶段':<10}{'耗时(s)':>10}{'重新开始':>10}{'读p50(ms)':>12}{'读p99(ms)':>12}{'写p99(ms)':>12}")
+    for name, action in phases:
+        start = time.perf_counter()
+        result, reads, writes = measure(action)
+        elapsed = time.perf_counter() - start
+        restarts = result[1]['database']['backup_restarts'] if result else '-'
+        print(f"{name:<10}{elapsed:>10.2f}{restarts:>10}{percentile(reads, 0.5):>12.2f}"
+              f"{percentile(reads, 0.99):>12.2f}{percentile(writes, 0.99):>12.2f}")
+
+
+def bench_coalesce(cinema_count=5000, clients=200):
+    """请求合并：大量客户端同时请求相同影院列表时的执行次数和总耗时"""
+    import database
+    import cinemas
+    from singleflight import read_coalescer
+
+    os.chdir(BENCH_DIR)
+    cinemas.init_cinemas_table()
+
+    def seed(cursor):
+        cursor.executemany(
+            'INSERT INTO cinemas (name, address, price, tags) VALUES (?, ?, ?, ?)',
+            ((f'影城{i}', f'地址{i}', 30 + i % 100, '["IMAX", "杜比", "情侣座"]') for i in range(cinema_count))
+        )
+    database.run_write(seed)
+
+    print(f"影院数: {cinema_count}, 同时请求的客户端: {clients}")
+    print(f"{'方式':<10}{'总耗时(s)':>12}{'平均延迟(ms)':>14}{'实际查询次数':>14}")
+    for name, func in (('不合并', cinemas.get_all_cinemas.__wrapped__), ('合并', cinemas.get_all_cinemas)):
+        barrier = threading.Barrier(clients)
+        latencies = []
+        before = read_coalescer.stats().get('cinemas.get_all_cinemas', {}).get('executions', 0)
+
+        def client(_):
+            barrier.wait()
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(client, range(clients)))
+        total = time.perf_counter() - start
+
+        if func is cinemas.get_all_cinemas:
+            executions = read_coalescer.stats()['cinemas.get_all_cinemas']['executions'] - before
+        else:
+            executions = clients
+        print(f"{name:<10}{total:>12.2f}{sum(latencies) / len(latencies) * 1000:>14.1f}{executions:>14}")
+
+
+def bench_encoding(cinema_count=1000, rounds=50):
+    """响应编码：影院列表在JSON、MessagePack、CBOR及列式布局下的编码耗时和大小"""
+    app_module = load_app()
+    app = app_module.app
+    import gzip
+
+    cinemas = [{
+        'id': i,
+        'name': f'影城{i}',
+        'address': f'测试市测试区测试路{i}号',
+        'price': 30.0 + i % 100,
+        'tags': ['IMAX', '杜比', '情侣座'],
+        'created_at': '2025-11-07 10:30:00',
+        'updated_at': '2025-11-07 10:30:00'
+    } for i in range(cinema_count)]
+    payload = {'success': True, 'cinemas': cinemas, 'count': cinema_count}
+
+    print(f"影院数: {cinema_count}")
+    print(f"{'格式':<22}{'编码(ms)':>10}{'大小(KB)':>10}{'gzip后(KB)':>12}")
+    for accept, layout in (('application/json', None), ('application/msgpack', None),
+                           ('application/msgpack', 'columnar'), ('application/cbor', None),
+                           ('application/cbor', 'columnar')):
+        query = f'?layout={layout}' if layout else ''
+        with app.test_request_context(f'/api/cinemas{query}', headers={'Accept': accept}):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                body = app_module.api_response(payload).get_data()
+            elapsed = (time.perf_counter() - start) / rounds
+        name = accept.split('/')[1] + (f' ({layout})' if layout else '')
+        print(f"{name:<22}{elapsed * 1000:>10.2f}{len(body) / 1024:>10.1f}{len(gzip.compress(body)) / 1024:>12.1f}")
+
+
+BENCHMARKS = {
+    'delivery': bench_delivery,
+    'group_commit': bench_group_commit,
+    'suggest': bench_suggest,
+    'similar': bench_similar,
+    'phash': bench_phash,
+    'backup': bench_backup,
+    'coalesce': bench_coalesce,
+    'encoding': bench_encoding,
+}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"用法: python benchmark.py <{'|'.join(BENCHMARKS)}>")
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]]()
@@ -0,0 +1,118 @@
+import json
+
+# 票价直方图的分桶宽度(元)
+PRICE_BUCKET_WIDTH = 20
+
+def init_facet_tables(cursor):
+    """初始化影院筛选聚合表，首次创建时根据已有影院数据回填"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cinema_tags (
+            cinema_id INTEGER NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (tag, cinema_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cinema_tags_cinema ON cinema_tags (cinema_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cinema_tag_counts (
+            tag TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cinema_price_buckets (
+            bucket INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL
+        )
+    ''')
+
+    cursor.execute('SELECT COUNT(*) AS count FROM cinema_price_buckets')
+    if cursor.fetchone()['count'] == 0:
+        rebuild_facets(cursor)
+
+def rebuild_facets(cursor):
+    """根据cinemas表全量重建聚合表"""
+    cursor.execute('DELETE FROM cinema_tags')
+    cursor.execute('DELETE FROM cinema_tag_counts')
+    cursor.execute('DELETE FROM cinema_price_buckets')
+
+    cursor.execute('SELECT id, price, tags FROM cinemas')
+    for cinema in cursor.fetchall():
+        tags = json.loads(cinema['tags']) if cinema['tags'] else []
+        apply_facet_change(cursor, cinema['id'], None, (cinema['price'], tags))
+
+def price_bucket(price):
+    """票价所在的分桶编号"""
+    return int(price // PRICE_BUCKET_WIDTH)
+
+def _adjust_count(cursor, table, column, key, delta):
+    cursor.execute(
+        f'''INSERT INTO {table} ({column}, count) VALUES (?, ?)
+        ON CONFLICT({column}) DO UPDATE SET count = count + excluded.count''',
+        (key, delta)
+    )
+    cursor.execute(f'DELETE FROM {table} WHERE {column} = ? AND count <= 0', (key,))
+
+def apply_facet_change(cursor, cinema_id, old, new):
+    """在影院写入的同一事务内增量维护聚合表
+
+    old/new 为 (price, tags) 元组，新增时old为None，删除时new为None
+    """
+    old_tags = set(old[1] or []) if old else set()
+    new_tags = set(new[1] or []) if new else set()
+
+    for tag in old_tags - new_tags:
+        cursor.execute('DELETE FROM cinema_tags WHERE tag = ? AND cinema_id = ?', (tag, cinema_id))
+        _adjust_count(cursor, 'cinema_tag_counts', 'tag', tag, -1)
+
+    for tag in new_tags - old_tags:
+        cursor.execute('INSERT INTO cinema_tags (cinema_id, tag) VALUES (?, ?)', (cinema_id, tag))
+        _adjust_count(cursor, 'cinema_tag_counts', 'tag', tag, 1)
+
+    old_bucket = price_bucket(old[0]) if old else None
+    new_bucket = price_bucket(new[0]) if new else None
+    if old_bucket != new_bucket:
+        if old_bucket is not None:
+            _adjust_count(cursor, 'cinema_price_buckets', 'bucket', old_bucket, -1)
+        if new_bucket is not None:
+            _adjust_count(cursor, 'cinema_price_buckets', 'bucket', new_bucket, 1)
+
+def _format_histogram(rows):
+    return [{
+        'min': row['bucket'] * PRICE_BUCKET_WIDTH,
+        'max': (row['bucket'] + 1) * PRICE_BUCKET_WIDTH,
+        'count': row['count']
+    } for row in rows]
+
+def query_facets(cursor, where_sql='', params=()):
+    """查询标签计数和票价直方图
+
+    没有筛选条件时直接读取聚合表；有筛选条件时基于cinema_tags做分组统计，不解析JSON
+    """
+    if not where_sql:
+        cursor.execute('SELECT tag, count FROM cinema_tag_counts ORDER BY count DESC, tag')
+        tag_rows = cursor.fetchall()
+        cursor.execute('SELECT bucket, count FROM cinema_price_buckets ORDER BY bucket')
+        bucket_rows = cursor.fetchall()
+    else:
+        cursor.execute(
+            f'''SELECT t.tag AS tag, COUNT(*) AS count
+            FROM cinema_tags t JOIN cinemas ON cinemas.id = t.cinema_id
+            WHERE {where_sql}
+            GROUP BY t.tag ORDER BY count DESC, t.tag''',
+            params
+        )
+        tag_rows = cursor.fetchall()
+        cursor.execute(
+            f'''SELECT CAST(price / ? AS INTEGER) AS bucket, COUNT(*) AS count
+            FROM cinemas WHERE {where_sql}
+            GROUP BY bucket ORDER BY bucket''',
+            (PRICE_BUCKET_WIDTH, *params)
+        )
+        bucket_rows = cursor.fetchall()
+
+    return {
+        'tags': [{'tag': row['tag'], 'count': row['count']} for row in tag_rows],
+        'price_histogram': _format_histogram(bucket_rows),
+        'price_bucket_width': PRICE_BUCKET_WIDTH
+    }
@@ -0,0 +1,339 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+from database import get_db_connection
+
+# 相似度 = 标签Jaccard相似度 * TAG_WEIGHT + 票价相似度 * PRICE_WEIGHT
+TAG_WEIGHT = 0.8
+PRICE_WEIGHT = 0.2
+# 票价差为PRICE_SCALE时票价相似度为0.5
+PRICE_SCALE = 30.0
+
+DEFAULT_SIMILAR_LIMIT = 10
+SNAPSHOT_PATH = 'cinema_similarity.npz'
+# 增量更新后延迟写快照的时间(秒)，合并短时间内的多次更新
+SNAPSHOT_DELAY = 30
+# 未连续应用的写入版本超过该数量时，认为有其他进程写入了影院，索引不再与某个版本对应
+MAX_PENDING_VERSIONS = 1024
+# 请求时检查数据库版本号的最小间隔(秒)，发现其他进程写入过影院时重建索引
+REFRESH_CHECK_INTERVAL = 1.0
+
+def init_similarity_version(cursor):
+    """初始化影院数据版本号，每次影院写入在同一事务内加一，用于判断快照是否过期"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cinema_index_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO cinema_index_version (id, version) VALUES (1, 0)')
+
+def bump_similarity_version(cursor):
+    """在影院写入的事务内递增版本号并返回新版本"""
+    cursor.execute('UPDATE cinema_index_version SET version = version + 1 WHERE id = 1 RETURNING version')
+    return cursor.fetchone()['version']
+
+class SimilarityIndex:
+    """基于NumPy的影院相似度索引
+
+    每家影院占一行：标签按词表编号存为位集（每64个标签一个uint64字），另存票价和标签数，
+    交集大小用 AND + popcount 向量化计算。行数按容量倍增预分配，删除的行放入空闲列表复用。
+    每家影院记录最后应用的写入版本（删除后保留），晚到的旧版本更新会被忽略。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset(rows=64, words=1)
+
+    def _reset(self, rows, words, version=None):
+        self.tags = np.zeros((rows, words), dtype=np.uint64)
+        self.tag_counts = np.zeros(rows, dtype=np.float32)
+        self.prices = np.zeros(rows, dtype=np.float32)
+        self.active = np.zeros(rows, dtype=bool)
+        self.ids = np.zeros(rows, dtype=np.int64)
+        self.vocabulary = {}
+        self.rows = {}
+        self.free_rows = []
+        self.size = 0
+        # 已连续应用到索引的最大写入版本，None表示无法对应到某个版本
+        self.version = version
+        self._pending_versions = set()
+        # 构建/加载时数据对应的版本，不超过该版本的更新已包含在索引中
+        self.base_version = version
+        # 构建之后各影院最后应用的写入版本 {id: version}，包含已删除的影院
+        self.row_versions = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _grow(self, rows=None, words=None):
+        old_rows, old_words = self.tags.shape
+        rows = max(rows or old_rows, old_rows)
+        words = max(words or old_words, old_words)
+        tags = np.zeros((rows, words), dtype=np.uint64)
+        tags[:old_rows, :old_words] = self.tags
+        self.tags = tags
+        if rows > old_rows:
+            extra = rows - old_rows
+            self.tag_counts = np.concatenate([self.tag_counts, np.zeros(extra, dtype=np.float32)])
+            self.prices = np.concatenate([self.prices, np.zeros(extra, dtype=np.float32)])
+            self.active = np.concatenate([self.active, np.zeros(extra, dtype=bool)])
+            self.ids = np.concatenate([self.ids, np.zeros(extra, dtype=np.int64)])
+
+    def _tag_bits(self, tags):
+        """把标签转换为位集，词表中没有的标签分配新的位"""
+        columns = []
+        for tag in set(tags or []):
+            column = self.vocabulary.get(tag)
+            if column is None:
+                column = len(self.vocabulary)
+                if column >= self.tags.shape[1] * 64:
+                    self._grow(words=self.tags.shape[1] * 2)
+                self.vocabulary[tag] = column
+            columns.append(column)
+
+        bits = np.zeros(self.tags.shape[1], dtype=np.uint64)
+        for column in columns:
+            bits[column // 64] |= np.uint64(1) << np.uint64(column % 64)
+        return bits, len(columns)
+
+    def _set_row(self, row, cinema_id, price, tags):
+        bits, count = self._tag_bits(tags)
+        self.tags[row] = bits
+        self.tag_counts[row] = count
+        self.prices[row] = price
+        self.ids[row] = cinema_id
+        self.active[row] = True
+
+    def _is_stale(self, cinema_id, version):
+        """该影院已应用过更新的版本时返回True"""
+        if version is None:
+            return False
+        if self.base_version is not None and version <= self.base_version:
+            return True
+        return self.row_versions.get(cinema_id, -1) >= version
+
+    def _mark_applied(self, version):
+        """记录已应用的写入版本；各请求线程提交后更新索引的顺序可能与提交顺序不同，只推进连续的部分"""
+        if version is None or self.version is None or version <= self.version:
+            return
+        self._pending_versions.add(version)
+        while self.version + 1 in self._pending_versions:
+            self.version += 1
+            self._pending_versions.remove(self.version)
+        if len(self._pending_versions) > MAX_PENDING_VERSIONS:
+            self.version = None
+            self._pending_versions.clear()
+
+    def build(self, cinemas, version=None):
+        """根据 (id, price, tags) 序列全量构建索引，version为这些数据对应的写入版本"""
+        cinemas = list(cinemas)
+        with self._lock:
+            self._reset(rows=max(64, len(cinemas)), words=1, version=version)
+            for row, (cinema_id, price, tags) in enumerate(cinemas):
+                self._set_row(row, cinema_id, price, tags)
+                self.rows[cinema_id] = row
+            self.size = len(cinemas)
+
+    def add(self, cinema_id, price, tags, version=None):
+        """新增或覆盖一家影院"""
+        with self._lock:
+            if self._is_stale(cinema_id, version):
+                self._mark_applied(version)
+                return
+            if version is not None:
+                self.row_versions[cinema_id] = version
+            row = self.rows.get(cinema_id)
+            if row is None:
+                if self.free_rows:
+                    row = self.free_rows.pop()
+                else:
+                    if self.size >= self.tags.shape[0]:
+                        self._grow(rows=self.tags.shape[0] * 2)
+                    row = self.size
+                    self.size += 1
+                self.rows[cinema_id] = row
+            self._set_row(row, cinema_id, price, tags)
+            self._mark_applied(version)
+
+    def remove(self, cinema_id, version=None):
+        """删除影院"""
+        with self._lock:
+            if self._is_stale(cinema_id, version):
+                self._mark_applied(version)
+                return
+            if version is not None:
+                self.row_versions[cinema_id] = version
+            row = self.rows.pop(cinema_id, None)
+            if row is not None:
+                self.active[row] = False
+                self.tags[row] = 0
+                self.free_rows.append(row)
+            self._mark_applied(version)
+
+    def similar(self, cinema_id, limit=DEFAULT_SIMILAR_LIMIT):
+        """返回与指定影院最相似的前limit家影院 [(id, score), ...]，影院不存在时返回None"""
+        with self._lock:
+            row = self.rows.get(cinema_id)
+            if row is None:
+                return None
+
+            size = self.size
+            # 向量化计算Jaccard：交集 = 按位与后的popcount，并集 = |A| + |B| - 交集
+            intersection = np.bitwise_count(self.tags[:size] & self.tags[row]).sum(axis=1, dtype=np.int32)
+            intersection = intersection.astype(np.float32)
+            union = self.tag_counts[:size] + self.tag_counts[row] - intersection
+            jaccard = np.divide(intersection, union, out=np.zeros(size, dtype=np.float32), where=union > 0)
+            price_similarity = 1.0 / (1.0 + np.abs(self.prices[:size] - self.prices[row]) / PRICE_SCALE)
+
+            scores = TAG_WEIGHT * jaccard + PRICE_WEIGHT * price_similarity
+            scores[~self.active[:size]] = -np.inf
+            scores[row] = -np.inf
+
+            candidates = min(limit, len(self.rows) - 1)
+            if candidates <= 0:
+                return []
+            top = np.argpartition(-scores, candidates - 1)[:candidates]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            return [(int(self.ids[i]), float(scores[i])) for i in top]
+
+    def save(self, path):
+        """原子写入快照，索引无法对应到某个写入版本时不写入并返回False"""
+        with self._lock:
+            if self.version is None:
+                return False
+            size = self.size
+            words = -(-len(self.vocabulary) // 64)
+            data = {
+                'tags': self.tags[:size, :words].copy(),
+                'prices': self.prices[:size].copy(),
+                'active': self.active[:size].copy(),
+                'ids': self.ids[:size].copy(),
+                'vocabulary': np.array(sorted(self.vocabulary, key=self.vocabulary.get), dtype=str),
+                'version': np.array(self.version, dtype=np.int64),
+            }
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **data)
+        os.replace(temp_path, path)
+        return True
+
+    def load(self, path, version, count):
+        """快照的写入版本和影院数都与数据库一致时加载并返回True"""
+        try:
+            with np.load(path) as data:
+                if 'version' not in data or int(data['version']) != version:
+                    return False
+                tags = data['tags']
+                prices = data['prices']
+                active = data['active']
+                ids = data['ids']
+                vocabulary = list(data['vocabulary'])
+        except (OSError, KeyError, ValueError):
+            return False
+        if tags.dtype != np.uint64 or int(active.sum()) != count:
+            return False
+
+        size = len(ids)
+        with self._lock:
+            self._reset(rows=max(64, size), words=max(1, tags.shape[1]), version=version)
+            self.tags[:size, :tags.shape[1]] = tags
+            self.tag_counts[:size] = np.bitwise_count(tags).sum(axis=1, dtype=np.int32)
+            self.prices[:size] = prices
+            self.active[:size] = active
+            self.ids[:size] = ids
+            self.vocabulary = {str(tag): column for column, tag in enumerate(vocabulary)}
+            self.rows = {int(ids[row]): row for row in np.flatnonzero(active)}
+            self.free_rows = [int(row) for row in np.flatnonzero(~active)]
+            self.size = size
+        return True
+
+# 进程内的全局相似度索引
+similarity_index = SimilarityIndex()
+_snapshot_timer = None
+_snapshot_lock = threading.Lock()
+
+def save_similarity_snapshot():
+    """写入相似度索引快照"""
+    global _snapshot_timer
+    with _snapshot_lock:
+        _snapshot_timer = None
+    similarity_index.save(SNAPSHOT_PATH)
+
+def schedule_similarity_snapshot():
+    """增量更新后延迟写快照，短时间内的多次更新只写一次"""
+    global _snapshot_timer
+    with _snapshot_lock:
+        if _snapshot_timer is None:
+            _snapshot_timer = threading.Timer(SNAPSHOT_DELAY, save_similarity_snapshot)
+            _snapshot_timer.daemon = True
+            _snapshot_timer.start()
+
+def _read_version(cursor):
+    cursor.execute('SELECT version FROM cinema_index_version WHERE id = 1')
+    return cursor.fetchone()['version']
+
+def _rebuild_from_database(cursor):
+    """在调用方已开始的读事务中读取版本号和全部影院并重建索引"""
+    version = _read_version(cursor)
+    cursor.execute('SELECT id, price, tags FROM cinemas')
+    rows = cursor.fetchall()
+    similarity_index.build(
+        ((row['id'], row['price'], json.loads(row['tags']) if row['tags'] else []) for row in rows),
+        version
+    )
+
+def load_similarity_index():
+    """启动时优先加载快照，快照缺失或过期时从数据库重建并写入新快照"""
+    global _last_refresh_check
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # 版本号和影院数据在同一个读事务中读取，保证二者对应
+    cursor.execute('BEGIN')
+    version = _read_version(cursor)
+    cursor.execute('SELECT COUNT(*) AS count FROM cinemas')
+    count = cursor.fetchone()['count']
+    _last_refresh_check = time.monotonic()
+
+    if similarity_index.load(SNAPSHOT_PATH, version, count):
+        conn.close()
+        print(f"影院相似度索引从快照加载完成，共 {len(similarity_index)} 家影院")
+        return
+
+    _rebuild_from_database(cursor)
+    conn.close()
+    similarity_index.save(SNAPSHOT_PATH)
+    print(f"影院相似度索引构建完成，共 {len(similarity_index)} 家影院")
+
+_last_refresh_check = 0.0
+_refresh_lock = threading.Lock()
+
+def refresh_similarity_index(force=False):
+    """索引只随本进程的写入增量更新；数据库版本号与索引不一致（其他worker/进程写入过影院）时重建
+
+    两次检查间隔至少REFRESH_CHECK_INTERVAL秒，force时立即检查；同一时刻只有一个线程重建，
+    其他请求继续使用旧索引。
+    """
+    global _last_refresh_check
+    now = time.monotonic()
+    if not force and now - _last_refresh_check < REFRESH_CHECK_INTERVAL:
+        return False
+    if not _refresh_lock.acquire(blocking=False):
+        return False
+    try:
+        _last_refresh_check = now
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        if _read_version(cursor) == similarity_index.version:
+            conn.close()
+            return False
+        _rebuild_from_database(cursor)
+        conn.close()
+    finally:
+        _refresh_lock.release()
+    schedule_similarity_snapshot()
+    print(f"影院相似度索引已按数据库版本 {similarity_index.version} 重建，共 {len(similarity_index)} 家影院")
+    return True
@@ -0,0 +1,129 @@
+import threading
+from bisect import bisect_left, bisect_right
+from pypinyin import lazy_pinyin
+from database import get_db_connection
+
+# 默认返回的联想条数
+DEFAULT_SUGGEST_LIMIT = 10
+
+def _search_keys(name, address):
+    """生成一家影院的所有前缀检索键：名称、地址、名称全拼、名称拼音首字母"""
+    keys = {name.lower(), address.lower()}
+    # 非汉字逐字符返回，保证拼音结果与名称逐字对齐，只需转换一次即可同时得到全拼和首字母
+    syllables = lazy_pinyin(name, errors=lambda chars: list(chars))
+    keys.add(''.join(syllables).lower())
+    keys.add(''.join(syllable[0] for syllable in syllables).lower())
+    keys.discard('')
+    return keys
+
+class PrefixIndex:
+    """基于有序数组和二分查找的影院前缀索引
+
+    _keys 和 _ids 为两个平行的有序数组，同一家影院的多个检索键各占一项
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._ids = []
+        self._cinemas = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cinemas)
+
+    def build(self, cinemas):
+        """根据 (id, name, address) 序列全量构建索引"""
+        entries = []
+        cinema_map = {}
+        for cinema_id, name, address in cinemas:
+            keys = _search_keys(name, address)
+            cinema_map[cinema_id] = (name, address, keys)
+            entries.extend((key, cinema_id) for key in keys)
+        entries.sort()
+
+        with self._lock:
+            self._keys = [key for key, _ in entries]
+            self._ids = [cinema_id for _, cinema_id in entries]
+            self._cinemas = cinema_map
+
+    def _insert(self, cinema_id, name, address):
+        keys = _search_keys(name, address)
+        for key in keys:
+            position = bisect_right(self._keys, key)
+            self._keys.insert(position, key)
+            self._ids.insert(position, cinema_id)
+        self._cinemas[cinema_id] = (name, address, keys)
+
+    def _remove(self, cinema_id):
+        name, address, keys = self._cinemas.pop(cinema_id)
+        for key in keys:
+            position = bisect_left(self._keys, key)
+            end = bisect_right(self._keys, key, position)
+            for i in range(position, end):
+                if self._ids[i] == cinema_id:
+                    del self._keys[i]
+                    del self._ids[i]
+                    break
+        return name, address
+
+    def add(self, cinema_id, name, address):
+        """新增影院"""
+        with self._lock:
+            if cinema_id in self._cinemas:
+                self._remove(cinema_id)
+            self._insert(cinema_id, name, address)
+
+    def update(self, cinema_id, name=None, address=None):
+        """更新影院名称或地址，未提供的字段保持不变"""
+        with self._lock:
+            if cinema_id not in self._cinemas:
+                return
+            old_name, old_address = self._remove(cinema_id)
+            self._insert(
+                cinema_id,
+                name if name is not None else old_name,
+                address if address is not None else old_address
+            )
+
+    def remove(self, cinema_id):
+        """删除影院"""
+        with self._lock:
+            if cinema_id in self._cinemas:
+                self._remove(cinema_id)
+
+    def suggest(self, prefix, limit=DEFAULT_SUGGEST_LIMIT):
+        """返回检索键以prefix开头的前limit家影院"""
+        prefix = prefix.strip().lower()
+        if not prefix or limit <= 0:
+            return []
+
+        results = []
+        seen = set()
+        with self._lock:
+            position = bisect_left(self._keys, prefix)
+            while position < len(self._keys) and len(results) < limit:
+                if not self._keys[position].startswith(prefix):
+                    break
+                cinema_id = self._ids[position]
+                if cinema_id not in seen:
+                    seen.add(cinema_id)
+                    name, address, _ = self._cinemas[cinema_id]
+                    results.append({'id': cinema_id, 'name': name, 'address': address})
+                position += 1
+        return results
+
+# 进程内的全局联想索引
+# 只随本进程的写入增量更新：多worker/多进程部署时，其他进程新增、修改或删除的影院
+# 在本进程重启前不会出现在（或仍会出现在）联想结果中
+suggest_index = PrefixIndex()
+
+def load_suggest_index():
+    """启动时从数据库构建联想索引"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, name, address FROM cinemas')
+    rows = cursor.fetchall()
+    conn.close()
+
+    suggest_index.build((row['id'], row['name'], row['address']) for row in rows)
+    print(f"影院联想索引构建完成，共 {len(suggest_index)} 家影院")
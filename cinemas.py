@@ -1,4 +1,9 @@
-from database import get_db_connection
+from database import get_db_connection, run_write
+from cinema_facets import init_facet_tables, apply_facet_change, query_facets
+from cinema_suggest import suggest_index
+from cinema_similarity import (similarity_index, schedule_similarity_snapshot,
+                               init_similarity_version, bump_similarity_version)
+from singleflight import coalesce
 import json
 from datetime import datetime
 
@@ -19,36 +24,49 @@ def init_cinemas_table():
         )
     ''')
     
+    # 列表按创建时间倒序，筛选按票价区间
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cinemas_created_at ON cinemas (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cinemas_price ON cinemas (price)')
+    
+    # 标签/票价聚合表
+    init_facet_tables(cursor)
+    # 相似度索引快照使用的数据版本号
+    init_similarity_version(cursor)
+    
     conn.commit()
     conn.close()
     print("影院表初始化完成")
 
 def add_cinema(name, address, price, tags=None):
     """添加新影院"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        # 将标签列表转换为JSON字符串
-        tags_json = json.dumps(tags) if tags else '[]'
-        
+    # 将标签列表转换为JSON字符串
+    tags_json = json.dumps(tags) if tags else '[]'
+    
+    def operation(cursor):
         cursor.execute(
             '''INSERT INTO cinemas (name, address, price, tags) 
             VALUES (?, ?, ?, ?)''',
             (name, address, price, tags_json)
         )
-        conn.commit()
         cinema_id = cursor.lastrowid
-        conn.close()
-        return cinema_id
-    except Exception as e:
-        conn.close()
-        raise e
+        apply_facet_change(cursor, cinema_id, None, (price, tags))
+        return cinema_id, bump_similarity_version(cursor)
+    
+    cinema_id, version = run_write(operation)
+    suggest_index.add(cinema_id, name, address)
+    similarity_index.add(cinema_id, price, tags, version)
+    schedule_similarity_snapshot()
+    return cinema_id
 
-def get_all_cinemas():
-    """获取所有影院"""
+@coalesce
+def get_all_cinemas(limit=None, offset=0):
+    """获取所有影院，可选分页"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM cinemas ORDER BY created_at DESC')
+    if limit is None:
+        cursor.execute('SELECT * FROM cinemas ORDER BY created_at DESC')
+    else:
+        cursor.execute('SELECT * FROM cinemas ORDER BY created_at DESC LIMIT ? OFFSET ?', (limit, offset))
     cinemas = cursor.fetchall()
     conn.close()
     
@@ -70,6 +88,7 @@ def get_all_cinemas():
     
     return cinema_list
 
+@coalesce
 def get_cinema_by_id(cinema_id):
     """根据ID获取影院"""
     conn = get_db_connection()
@@ -93,11 +112,40 @@ def get_cinema_by_id(cinema_id):
         }
     return None
 
-def update_cinema(cinema_id, name=None, address=None, price=None, tags=None):
-    """更新影院信息"""
+@coalesce
+def get_cinemas_by_ids(cinema_ids):
+    """按给定ID顺序批量获取影院，不存在的ID会被跳过"""
+    if not cinema_ids:
+        return []
+    
     conn = get_db_connection()
     cursor = conn.cursor()
+    placeholders = ', '.join('?' for _ in cinema_ids)
+    cursor.execute(f'SELECT * FROM cinemas WHERE id IN ({placeholders})', list(cinema_ids))
+    cinemas = {cinema['id']: cinema for cinema in cursor.fetchall()}
+    conn.close()
+    
+    cinema_list = []
+    for cinema_id in cinema_ids:
+        cinema = cinemas.get(cinema_id)
+        if not cinema:
+            continue
+        tags = json.loads(cinema['tags']) if cinema['tags'] else []
+        
+        cinema_list.append({
+            'id': cinema['id'],
+            'name': cinema['name'],
+            'address': cinema['address'],
+            'price': cinema['price'],
+            'tags': tags,
+            'created_at': cinema['created_at'],
+            'updated_at': cinema['updated_at']
+        })
     
+    return cinema_list
+
+def update_cinema(cinema_id, name=None, address=None, price=None, tags=None):
+    """更新影院信息"""
     # 构建更新字段和值
     update_fields = []
     values = []
@@ -128,50 +176,84 @@ def update_cinema(cinema_id, name=None, address=None, price=None, tags=None):
     
     if update_fields:
         query = f"UPDATE cinemas SET {', '.join(update_fields)} WHERE id = ?"
-        cursor.execute(query, values)
-        conn.commit()
-        conn.close()
+        
+        def operation(cursor):
+            cursor.execute('SELECT price, tags FROM cinemas WHERE id = ?', (cinema_id,))
+            old = cursor.fetchone()
+            cursor.execute(query, values)
+            if not old:
+                return None
+            old_tags = json.loads(old['tags']) if old['tags'] else []
+            new_price = price if price is not None else old['price']
+            new_tags = tags if tags is not None else old_tags
+            apply_facet_change(cursor, cinema_id, (old['price'], old_tags), (new_price, new_tags))
+            return new_price, new_tags, bump_similarity_version(cursor)
+        
+        updated = run_write(operation)
+        if updated:
+            suggest_index.update(cinema_id, name, address)
+            similarity_index.add(cinema_id, *updated)
+            schedule_similarity_snapshot()
         return True
     else:
-        conn.close()
         return False
 
 def delete_cinema(cinema_id):
     """删除影院"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM cinemas WHERE id = ?', (cinema_id,))
-    conn.commit()
-    affected_rows = cursor.rowcount
-    conn.close()
+    def operation(cursor):
+        cursor.execute('SELECT price, tags FROM cinemas WHERE id = ?', (cinema_id,))
+        old = cursor.fetchone()
+        cursor.execute('DELETE FROM cinemas WHERE id = ?', (cinema_id,))
+        affected_rows = cursor.rowcount
+        if not old:
+            return affected_rows, None
+        old_tags = json.loads(old['tags']) if old['tags'] else []
+        apply_facet_change(cursor, cinema_id, (old['price'], old_tags), None)
+        return affected_rows, bump_similarity_version(cursor)
     
-    return affected_rows > 0
+    affected_rows, version = run_write(operation)
+    if affected_rows > 0:
+        suggest_index.remove(cinema_id)
+        similarity_index.remove(cinema_id, version)
+        schedule_similarity_snapshot()
+        return True
+    return False
 
-def search_cinemas(keyword=None, min_price=None, max_price=None, tag=None):
-    """搜索影院"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    query = "SELECT * FROM cinemas WHERE 1=1"
+def build_search_filters(keyword=None, min_price=None, max_price=None, tag=None):
+    """构建搜索条件，返回 (WHERE子句, 参数列表)，没有条件时WHERE子句为空字符串"""
+    conditions = []
     params = []
     
     if keyword:
-        query += " AND (name LIKE ? OR address LIKE ?)"
+        conditions.append("(cinemas.name LIKE ? OR cinemas.address LIKE ?)")
         params.extend([f'%{keyword}%', f'%{keyword}%'])
     
     if min_price is not None:
-        query += " AND price >= ?"
+        conditions.append("cinemas.price >= ?")
         params.append(min_price)
     
     if max_price is not None:
-        query += " AND price <= ?"
+        conditions.append("cinemas.price <= ?")
         params.append(max_price)
     
     if tag:
-        query += " AND tags LIKE ?"
-        params.append(f'%"{tag}"%')
+        # 使用标签关联表精确匹配，避免对JSON字符串做LIKE扫描
+        conditions.append("cinemas.id IN (SELECT cinema_id FROM cinema_tags WHERE tag = ?)")
+        params.append(tag)
     
+    return ' AND '.join(conditions), params
+
+@coalesce
+def search_cinemas(keyword=None, min_price=None, max_price=None, tag=None):
+    """搜索影院"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    where_sql, params = build_search_filters(keyword, min_price, max_price, tag)
+    
+    query = "SELECT * FROM cinemas"
+    if where_sql:
+        query += f" WHERE {where_sql}"
     query += " ORDER BY created_at DESC"
     
     cursor.execute(query, params)
@@ -193,4 +275,16 @@ def search_cinemas(keyword=None, min_price=None, max_price=None, tag=None):
             'updated_at': cinema['updated_at']
         })
     
-    return cinema_list
\ No newline at end of file
+    return cinema_list
+
+@coalesce
+def get_cinema_facets(keyword=None, min_price=None, max_price=None, tag=None):
+    """获取当前筛选条件下的标签计数和票价直方图"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    where_sql, params = build_search_filters(keyword, min_price, max_price, tag)
+    facets = query_facets(cursor, where_sql, params)
+    
+    conn.close()
+    return facets
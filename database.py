@@ -1,7 +1,190 @@
+import os
+import queue
 import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+DATABASE_PATH = 'user_auth.db'
+
+# 组提交配置：写线程在收到第一个写操作后最多再等待的时间(秒)和每批最大操作数
+GROUP_COMMIT_WINDOW = 0.002
+GROUP_COMMIT_MAX_BATCH = 256
+
+# 读连接池中最多保留的空闲连接数
+READ_POOL_SIZE = 16
+
+# 可选的SQL跟踪回调，设置后对之后新建的所有连接生效（用于查询计划检查等）
+_trace_callback = None
+
+# 写操作结果
+WriteResult = namedtuple('WriteResult', ['lastrowid', 'rowcount'])
+
+class PooledConnection(sqlite3.Connection):
+    """close()时归还连接池而不是真正关闭的连接"""
+
+    pool = None
+
+    def close(self):
+        if self.pool is None or not self.pool.release(self):
+            super().close()
+
+class ConnectionPool:
+    """SQLite连接池，避免每次查询都重新打开数据库文件"""
+
+    def __init__(self, path=DATABASE_PATH, size=READ_POOL_SIZE):
+        self.path = path
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.path, factory=PooledConnection, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.set_trace_callback(_trace_callback)
+            conn.pool = self
+            return conn
+
+    def release(self, conn):
+        """归还连接，池已满时返回False由调用方真正关闭"""
+        try:
+            # 丢弃调用方未提交的事务，保证下一个使用者拿到干净的连接
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put_nowait(conn)
+            return True
+        except (queue.Full, sqlite3.Error):
+            return False
+
+def set_trace_callback(callback):
+    """设置SQL跟踪回调，需在首次访问数据库之前调用"""
+    global _trace_callback
+    _trace_callback = callback
+
+_pool = None
+_pool_pid = None
 
 def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect('user_auth.db')
-    conn.row_factory = sqlite3.Row
-    return conn
\ No newline at end of file
+    """获取数据库连接（来自当前进程的连接池，close()即归还）"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ConnectionPool()
+        _pool_pid = os.getpid()
+    return _pool.acquire()
+
+class DatabaseWriter:
+    """单写线程：通过队列接收写操作，按批次组提交，结果通过Future返回"""
+
+    def __init__(self, path=DATABASE_PATH, window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX_BATCH):
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.stats = {'operations': 0, 'batches': 0}
+        # 已提交的批次数，在通知调用方之前递增
+        self.generation = 0
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, operation):
+        """提交写操作，operation接收cursor并返回结果，返回Future"""
+        future = Future()
+        self.queue.put((operation, future))
+        return future
+
+    def _connect(self):
+        # 自动提交模式，由写线程显式管理事务
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.set_trace_callback(_trace_callback)
+        # WAL模式下读连接不会被写事务阻塞
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _collect_batch(self):
+        """阻塞等待第一个写操作，然后在时间窗口内尽量收集更多操作"""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = self._connect()
+        cursor = conn.cursor()
+        while True:
+            batch = self._collect_batch()
+            results = []
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                for operation, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    # 每个操作使用独立的保存点，单个操作失败不影响同批次的其他操作
+                    cursor.execute('SAVEPOINT write_op')
+                    try:
+                        results.append((future, operation(cursor), None))
+                        cursor.execute('RELEASE write_op')
+                    except Exception as e:
+                        cursor.execute('ROLLBACK TO write_op')
+                        cursor.execute('RELEASE write_op')
+                        results.append((future, None, e))
+                cursor.execute('COMMIT')
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                for operation, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.stats['operations'] += len(results)
+            self.stats['batches'] += 1
+            self.generation += 1
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+def get_db_writer():
+    """获取当前进程的写线程（fork后的子进程会重新创建）"""
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer_pid != os.getpid():
+                _writer = DatabaseWriter()
+                _writer_pid = os.getpid()
+    return _writer
+
+def get_write_generation():
+    """当前进程已提交的写批次数，写操作返回时已包含该次提交"""
+    writer = _writer
+    if writer is None or _writer_pid != os.getpid():
+        return 0
+    return writer.generation
+
+def run_write(operation):
+    """在写线程中执行operation(cursor)并等待结果"""
+    return get_db_writer().submit(operation).result()
+
+def execute_write(query, params=()):
+    """在写线程中执行单条写语句，返回WriteResult"""
+    def operation(cursor):
+        cursor.execute(query, params)
+        return WriteResult(cursor.lastrowid, cursor.rowcount)
+    return run_write(operation)
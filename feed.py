@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait
+from swapper_images import get_all_swapper_images
+from cinemas import get_all_cinemas
+from models import get_user_by_username
+
+# 首页聚合接口的可选分区
+FEED_SECTIONS = ('swapper', 'cinemas', 'user')
+
+# 默认配置，可在app.config中覆盖
+DEFAULT_FEED_TIMEOUT = 2.0                          # 整个聚合请求等待各分区的最长时间(秒)
+DEFAULT_FEED_CACHE_TTL = {'swapper': 60, 'cinemas': 10}  # 各分区缓存时间(秒)，user分区不缓存
+# 缓存键包含客户端传入的分页参数，限制条目数，超过时淘汰最久未使用的条目
+FEED_CACHE_MAX_ENTRIES = 256
+
+# 各分区查询共用的线程池，查询本身使用连接池中的连接
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='feed')
+
+class SectionCache:
+    """带过期时间和容量上限(LRU)的分区结果缓存"""
+
+    def __init__(self, max_entries=FEED_CACHE_MAX_ENTRIES):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now + ttl, value)
+            self._entries.move_to_end(key)
+            # 先清理已过期的条目，仍超过上限时淘汰最久未使用的
+            expired = [k for k, (expires, _) in self._entries.items() if expires <= now]
+            for k in expired:
+                del self._entries[k]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+section_cache = SectionCache()
+
+def _load_swapper():
+    return get_all_swapper_images()
+
+def _with_image_urls(images, base_url):
+    # 缓存和合并调用共享同一个列表，构建新的字典而不是原地修改
+    return [{**image, 'imageURL': f"{base_url}/api/swapper/image/{image['id']}"} for image in images]
+
+def _load_cinemas(limit, offset):
+    cinemas = get_all_cinemas(limit, offset)
+    return {'items': cinemas, 'limit': limit, 'offset': offset, 'count': len(cinemas)}
+
+def _load_user(username):
+    user = get_user_by_username(username)
+    if not user:
+        return None
+    return {
+        'id': user['id'],
+        'username': user['username'],
+        'created_at': user['created_at']
+    }
+
+def _cache_result(cache_key, ttl, future):
+    if future.exception() is None:
+        section_cache.set(cache_key, future.result(), ttl)
+
+def build_feed(base_url, sections=FEED_SECTIONS, limit=20, offset=0, username=None, config=None):
+    """并发查询各分区并组合为首页数据
+
+    单个分区失败或超时不影响其他分区，返回 (分区数据, 错误信息)
+    """
+    config = config or {}
+    timeout = config.get('FEED_TIMEOUT', DEFAULT_FEED_TIMEOUT)
+    cache_ttl = config.get('FEED_CACHE_TTL', DEFAULT_FEED_CACHE_TTL)
+
+    loaders = {}
+    if 'swapper' in sections:
+        # 缓存的是图片列表本身，访问地址在返回前按本次请求的base_url拼接
+        loaders['swapper'] = (('swapper',), _load_swapper, ())
+    if 'cinemas' in sections:
+        loaders['cinemas'] = (('cinemas', limit, offset), _load_cinemas, (limit, offset))
+    if 'user' in sections and username:
+        loaders['user'] = (None, _load_user, (username,))
+
+    data = {}
+    errors = {}
+    futures = {}
+    for name, (cache_key, loader, args) in loaders.items():
+        cached = section_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            data[name] = cached
+            continue
+
+        future = _executor.submit(loader, *args)
+        if cache_key and name in cache_ttl:
+            # 即使本次请求已超时返回，查询完成后结果仍会写入缓存供后续请求使用
+            future.add_done_callback(partial(_cache_result, cache_key, cache_ttl[name]))
+        futures[future] = name
+
+    done, not_done = wait(futures, timeout=timeout)
+
+    for future in done:
+        name = futures[future]
+        try:
+            data[name] = future.result()
+        except Exception as e:
+            data[name] = None
+            errors[name] = f'加载失败: {str(e)}'
+
+    for future in not_done:
+        name = futures[future]
+        data[name] = None
+        errors[name] = '加载超时'
+
+    if data.get('swapper') is not None:
+        data['swapper'] = _with_image_urls(data['swapper'], base_url)
+
+    return data, errors
@@ -0,0 +1,52 @@
+import os
+import mimetypes
+from flask import Response, send_file
+
+# 支持的图片分发模式
+DELIVERY_MODES = ('send_file', 'x-accel-redirect', 'x-sendfile')
+
+
+def normalize_upload_path(image_url):
+    """规范化数据库中保存的文件路径（兼容Windows下保存的反斜杠路径）"""
+    return image_url.replace('\\', '/')
+
+
+def _send_offload(path, mode, upload_folder, accel_prefix):
+    """只返回头部，由前置代理（nginx/Apache/lighttpd）负责传输文件内容"""
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    response = Response(mimetype=mimetype)
+
+    if mode == 'x-accel-redirect':
+        # nginx内部location需要的是相对上传目录的路径
+        relative_path = os.path.relpath(path, os.path.abspath(upload_folder)).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + relative_path
+    else:
+        response.headers['X-Sendfile'] = path
+
+    return response
+
+
+def _is_inside(path, folder):
+    """path是否位于folder目录内"""
+    folder = os.path.abspath(folder)
+    return os.path.commonpath([path, folder]) == folder
+
+
+def send_upload_file(image_url, config):
+    """按照配置的分发模式返回上传的文件"""
+    mode = config.get('SWAPPER_DELIVERY_MODE', 'send_file')
+    if mode not in DELIVERY_MODES:
+        raise ValueError(f'不支持的图片分发模式: {mode}')
+
+    # Flask的send_file会把相对路径解析到应用根目录，这里统一转换为绝对路径
+    path = os.path.abspath(normalize_upload_path(image_url))
+    if not os.path.isfile(path):
+        return None
+
+    # 前置代理只能访问上传目录，不在上传目录内的旧记录由Python直接返回
+    if mode != 'send_file' and _is_inside(path, config['UPLOAD_FOLDER']):
+        return _send_offload(path, mode, config['UPLOAD_FOLDER'], config.get('SWAPPER_ACCEL_PREFIX', '/protected/swapper/'))
+
+    # send_file默认带ETag/Last-Modified并处理条件请求和Range；
+    # gunicorn等服务器的wsgi.file_wrapper会使用os.sendfile输出
+    return send_file(path, max_age=config.get('SWAPPER_CACHE_MAX_AGE', 0))
@@ -0,0 +1,179 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+from flask import request, jsonify, make_response, current_app, Response
+from database import get_db_connection, execute_write, run_write
+
+# 默认配置，可在app.config中覆盖
+DEFAULT_IDEMPOTENCY_TTL = 24 * 3600        # 已完成结果的保留时间(秒)
+DEFAULT_IDEMPOTENCY_WAIT_TIMEOUT = 10      # 并发重复请求等待首个请求完成的最长时间(秒)
+DEFAULT_IDEMPOTENCY_LOCK_TIMEOUT = 60      # 进行中记录超过该时间视为已失效(进程崩溃等)
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+POLL_INTERVAL = 0.05
+PURGE_INTERVAL = 60
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+_last_purge = 0.0
+
+def init_idempotency_table():
+    """初始化幂等键表"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # status_code为NULL表示请求仍在处理中
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key BLOB PRIMARY KEY,
+            fingerprint BLOB NOT NULL,
+            status_code INTEGER,
+            content_type TEXT,
+            body BLOB,
+            created_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # 过期清理按创建时间删除
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys (created_at)')
+    conn.commit()
+    conn.close()
+
+def _storage_key(idempotency_key):
+    """幂等键按 方法 + 路径 + 调用者凭证 隔离，避免不同用户或接口之间冲突"""
+    scope = '\n'.join([
+        request.method,
+        request.path,
+        request.headers.get('Authorization', ''),
+        idempotency_key
+    ])
+    return hashlib.sha256(scope.encode('utf-8')).digest()
+
+def _request_fingerprint():
+    """请求内容指纹，同一幂等键对应的请求内容必须一致"""
+    digest = hashlib.sha256()
+    digest.update(request.query_string)
+    if request.files or request.form:
+        # multipart每次重试的boundary可能不同，因此按字段和文件内容计算
+        for name, value in sorted(request.form.items(multi=True)):
+            digest.update(f'{name}={value}\n'.encode('utf-8'))
+        for name, file in sorted(request.files.items(multi=True), key=lambda item: item[0]):
+            digest.update(f'{name}:{file.filename}\n'.encode('utf-8'))
+            for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+                digest.update(chunk)
+            file.stream.seek(0)
+    else:
+        digest.update(request.get_data(cache=True))
+    return digest.digest()
+
+def _purge_expired(ttl):
+    """定期清理过期记录"""
+    global _last_purge
+    now = time.time()
+    if now - _last_purge < PURGE_INTERVAL:
+        return
+    _last_purge = now
+    execute_write('DELETE FROM idempotency_keys WHERE created_at < ?', (now - ttl,))
+
+def _load(key):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM idempotency_keys WHERE key = ?', (key,))
+    row = cursor.fetchone()
+    conn.close()
+    return row
+
+def _claim(key, fingerprint, lock_timeout):
+    """尝试占用幂等键，成功返回True；同时回收超时未完成的记录"""
+    now = time.time()
+
+    def operation(cursor):
+        cursor.execute(
+            'DELETE FROM idempotency_keys WHERE key = ? AND status_code IS NULL AND created_at < ?',
+            (key, now - lock_timeout)
+        )
+        cursor.execute(
+            'INSERT OR IGNORE INTO idempotency_keys (key, fingerprint, created_at) VALUES (?, ?, ?)',
+            (key, fingerprint, now)
+        )
+        return cursor.rowcount > 0
+
+    return run_write(operation)
+
+def _replay(row):
+    response = Response(row['body'], status=row['status_code'], content_type=row['content_type'])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def _conflict(message, status_code):
+    return jsonify({
+        'success': False,
+        'message': message
+    }), status_code
+
+def idempotent(view):
+    """为修改类接口提供Idempotency-Key支持
+
+    相同键的重试直接返回首次请求保存的结果，不重复执行；并发的重复请求等待首个请求完成。
+    5xx响应和异常不会被保存，客户端可以使用同一个键重试。
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if request.method in ('GET', 'HEAD', 'OPTIONS') or not idempotency_key:
+            return view(*args, **kwargs)
+
+        if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return _conflict('Idempotency-Key过长', 400)
+
+        config = current_app.config
+        ttl = config.get('IDEMPOTENCY_TTL', DEFAULT_IDEMPOTENCY_TTL)
+        wait_timeout = config.get('IDEMPOTENCY_WAIT_TIMEOUT', DEFAULT_IDEMPOTENCY_WAIT_TIMEOUT)
+        lock_timeout = config.get('IDEMPOTENCY_LOCK_TIMEOUT', DEFAULT_IDEMPOTENCY_LOCK_TIMEOUT)
+
+        key = _storage_key(idempotency_key)
+        fingerprint = _request_fingerprint()
+        _purge_expired(ttl)
+
+        deadline = time.monotonic() + wait_timeout
+        while not _claim(key, fingerprint, lock_timeout):
+            row = _load(key)
+            if row is None:
+                # 首个请求失败后释放了该键，重新尝试占用
+                continue
+            if row['fingerprint'] != fingerprint:
+                return _conflict('Idempotency-Key已被用于内容不同的请求', 422)
+            if row['status_code'] is not None:
+                return _replay(row)
+            if time.monotonic() >= deadline:
+                return _conflict('相同Idempotency-Key的请求正在处理中，请稍后重试', 409)
+
+            # 同进程内的请求直接等待其完成通知，跨进程则轮询数据库
+            with _in_flight_lock:
+                event = _in_flight.get(key)
+            if event is not None:
+                event.wait(POLL_INTERVAL)
+            else:
+                time.sleep(POLL_INTERVAL)
+
+        event = threading.Event()
+        with _in_flight_lock:
+            _in_flight[key] = event
+
+        try:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code < 500 and not response.is_streamed:
+                execute_write(
+                    'UPDATE idempotency_keys SET status_code = ?, content_type = ?, body = ? WHERE key = ?',
+                    (response.status_code, response.content_type, response.get_data(), key)
+                )
+            else:
+                execute_write('DELETE FROM idempotency_keys WHERE key = ?', (key,))
+            return response
+        except BaseException:
+            execute_write('DELETE FROM idempotency_keys WHERE key = ?', (key,))
+            raise
+        finally:
+            with _in_flight_lock:
+                _in_flight.pop(key, None)
+            event.set()
+
+    return wrapper
@@ -0,0 +1,224 @@
+"""Swapper图像感知哈希与近似重复检测
+
+用法: python image_hash.py scan [--delete]
+    为库中尚未计算哈希的图片补算哈希，并列出近似重复的图片组；
+    --delete 时每组只保留最早上传的一张，删除其余图片。
+"""
+import sys
+import threading
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+from database import get_db_connection, execute_write
+from file_delivery import normalize_upload_path
+
+# 汉明距离不超过该值视为近似重复（64位dHash）
+DEFAULT_HAMMING_THRESHOLD = 6
+HASH_SIZE = 8
+
+def compute_phash(source):
+    """计算64位差值哈希(dHash)，source为文件路径或文件对象；无法识别或像素数超出Pillow上限的图片返回None
+
+    缩放到9x8灰度图后比较相邻像素的明暗，对重新编码、缩放和轻微调色不敏感。
+    """
+    try:
+        with Image.open(source) as image:
+            # draft让JPEG在解码时直接缩小，避免完整解码大图
+            image.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))
+            pixels = np.asarray(
+                image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS),
+                dtype=np.int16
+            )
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+        return None
+
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return to_signed(value)
+
+def to_signed(value):
+    """SQLite的INTEGER是有符号64位，存储前转换"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+class HashIndex:
+    """内存中的感知哈希索引，用XOR + popcount向量化计算汉明距离"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ids = np.zeros(64, dtype=np.int64)
+        self.hashes = np.zeros(64, dtype=np.uint64)
+        self.size = 0
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def build(self, entries):
+        """根据 (id, phash) 序列全量构建"""
+        entries = [(image_id, phash) for image_id, phash in entries if phash is not None]
+        with self._lock:
+            capacity = max(64, len(entries))
+            self.ids = np.zeros(capacity, dtype=np.int64)
+            self.hashes = np.zeros(capacity, dtype=np.uint64)
+            for row, (image_id, phash) in enumerate(entries):
+                self.ids[row] = image_id
+                self.hashes[row] = np.int64(phash).view(np.uint64)
+            self.rows = {image_id: row for row, (image_id, _) in enumerate(entries)}
+            self.size = len(entries)
+
+    def add(self, image_id, phash):
+        if phash is None:
+            return
+        with self._lock:
+            if image_id in self.rows:
+                self.hashes[self.rows[image_id]] = np.int64(phash).view(np.uint64)
+                return
+            if self.size >= len(self.ids):
+                self.ids = np.concatenate([self.ids, np.zeros(len(self.ids), dtype=np.int64)])
+                self.hashes = np.concatenate([self.hashes, np.zeros(len(self.hashes), dtype=np.uint64)])
+            self.ids[self.size] = image_id
+            self.hashes[self.size] = np.int64(phash).view(np.uint64)
+            self.rows[image_id] = self.size
+            self.size += 1
+
+    def remove(self, image_id):
+        """删除时把最后一行移到被删除的位置，保持数组紧凑"""
+        with self._lock:
+            row = self.rows.pop(image_id, None)
+            if row is None:
+                return
+            last = self.size - 1
+            if row != last:
+                self.ids[row] = self.ids[last]
+                self.hashes[row] = self.hashes[last]
+                self.rows[int(self.ids[row])] = row
+            self.size = last
+
+    def distances(self, phash):
+        """与所有图片的汉明距离"""
+        target = np.int64(phash).view(np.uint64)
+        return np.bitwise_count(self.hashes[:self.size] ^ target)
+
+    def nearest(self, phash, threshold=DEFAULT_HAMMING_THRESHOLD):
+        """返回距离不超过threshold的最近图片 (id, 距离)，没有时返回None"""
+        if phash is None:
+            return None
+        with self._lock:
+            if self.size == 0:
+                return None
+            distances = self.distances(phash)
+            row = int(np.argmin(distances))
+            if distances[row] > threshold:
+                return None
+            return int(self.ids[row]), int(distances[row])
+
+    def duplicate_groups(self, threshold=DEFAULT_HAMMING_THRESHOLD):
+        """找出所有近似重复组，每组按图片ID升序"""
+        with self._lock:
+            ids = self.ids[:self.size].copy()
+            hashes = self.hashes[:self.size].copy()
+
+        order = np.argsort(ids)
+        ids, hashes = ids[order], hashes[order]
+        grouped = np.zeros(len(ids), dtype=bool)
+        groups = []
+        for row in range(len(ids)):
+            if grouped[row]:
+                continue
+            # 每张图与其后所有图片一次性计算距离
+            matches = np.flatnonzero(np.bitwise_count(hashes[row + 1:] ^ hashes[row]) <= threshold) + row + 1
+            matches = matches[~grouped[matches]]
+            if len(matches):
+                grouped[matches] = True
+                groups.append([int(ids[row])] + [int(image_id) for image_id in ids[matches]])
+        return groups
+
+# 进程内的全局哈希索引
+# 只随本进程的上传增量更新：其他worker/进程上传的图片在本进程重启前不参与重复检测；
+# 其他进程删除的图片由上传接口在命中时确认并从索引中移除
+hash_index = HashIndex()
+
+def load_hash_index(backfill=True):
+    """启动时从数据库加载图片哈希
+
+    尚未计算哈希的已有图片在后台线程中补算，不阻塞启动和请求；补算完成前这些图片不参与重复检测。
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, phash FROM swapper_images WHERE phash IS NOT NULL')
+    rows = cursor.fetchall()
+    conn.close()
+
+    hash_index.build((row['id'], row['phash']) for row in rows)
+    print(f"图片哈希索引加载完成，共 {len(hash_index)} 张图片")
+    if backfill:
+        threading.Thread(target=_backfill_in_background, name='phash-backfill', daemon=True).start()
+
+def _backfill_in_background():
+    try:
+        updated, unreadable = backfill_hashes()
+    except Exception as e:
+        print(f"补算图片哈希失败: {str(e)}")
+        return
+    if updated or unreadable:
+        print(f"补算图片哈希 {updated} 张，无法读取 {len(unreadable)} 张")
+
+def backfill_hashes():
+    """为尚未计算哈希的图片补算哈希，返回 (补算数量, 无法读取的图片ID列表)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, imageURL FROM swapper_images WHERE phash IS NULL')
+    rows = cursor.fetchall()
+
+    updated = 0
+    unreadable = []
+    for row in rows:
+        # 多个worker同时补算时，跳过其他worker已经算好的图片
+        cursor.execute('SELECT phash FROM swapper_images WHERE id = ?', (row['id'],))
+        current = cursor.fetchone()
+        if current is None:
+            continue
+        if current['phash'] is not None:
+            hash_index.add(row['id'], current['phash'])
+            continue
+
+        phash = compute_phash(normalize_upload_path(row['imageURL']))
+        if phash is None:
+            unreadable.append(row['id'])
+            continue
+        execute_write('UPDATE swapper_images SET phash = ? WHERE id = ?', (phash, row['id']))
+        hash_index.add(row['id'], phash)
+        updated += 1
+    conn.close()
+    return updated, unreadable
+
+def scan_library(delete=False, threshold=DEFAULT_HAMMING_THRESHOLD):
+    """批量扫描已有图片库中的近似重复"""
+    from swapper_images import init_swapper_table, delete_swapper_image
+
+    init_swapper_table()
+    load_hash_index(backfill=False)
+    updated, unreadable = backfill_hashes()
+    print(f"补算哈希 {updated} 张，无法读取 {len(unreadable)} 张 {unreadable if unreadable else ''}")
+
+    groups = hash_index.duplicate_groups(threshold)
+    if not groups:
+        print("未发现近似重复的图片")
+        return groups
+
+    for group in groups:
+        keep, duplicates = group[0], group[1:]
+        print(f"保留 {keep}，近似重复: {duplicates}")
+        if delete:
+            for image_id in duplicates:
+                delete_swapper_image(image_id)
+    if delete:
+        print(f"已删除 {sum(len(group) - 1 for group in groups)} 张重复图片")
+    return groups
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'scan':
+        print("用法: python image_hash.py scan [--delete]")
+        sys.exit(1)
+    scan_library(delete='--delete' in sys.argv[2:])
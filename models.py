@@ -1,4 +1,4 @@
-from database import get_db_connection
+from database import get_db_connection, execute_write
 
 def init_db():
     """初始化数据库表"""
@@ -48,20 +48,11 @@ def init_db():
 
 def add_user(username, password):
     """添加新用户"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            'INSERT INTO users (username, password) VALUES (?, ?)',
-            (username, password)
-        )
-        conn.commit()
-        user_id = cursor.lastrowid
-        conn.close()
-        return user_id
-    except Exception as e:
-        conn.close()
-        raise e
+    result = execute_write(
+        'INSERT INTO users (username, password) VALUES (?, ?)',
+        (username, password)
+    )
+    return result.lastrowid
 
 def get_user_by_username(username):
     """根据用户名获取用户"""
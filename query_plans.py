@@ -0,0 +1,197 @@
+"""查询计划回归检查
+
+在临时目录中按接近生产的数据量建库，逐个调用 models.py、cinemas.py、swapper_images.py
+中的数据库函数，记录其实际执行的每条SQL，用 EXPLAIN QUERY PLAN 检查索引使用情况，
+并检查每次调用的耗时上限。任何一条不满足时以非零状态退出。
+
+用法: python query_plans.py
+"""
+import os
+import re
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+SEED_CINEMAS = 20000
+SEED_USERS = 5000
+SEED_SWAPPER_IMAGES = 2000
+SEED_TAGS = ['IMAX', '杜比', '4DX', '情侣座', '停车场', '巨幕', '儿童票', '午夜场', '3D', '自助检票']
+
+# 不记录执行计划的语句（事务控制等）
+SKIPPED_STATEMENTS = re.compile(r'^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|PRAGMA)\b', re.IGNORECASE)
+# 全表扫描：SCAN后面没有 USING INDEX 的才算
+FULL_SCAN = re.compile(r'^SCAN (\w+)\b(?! USING)')
+
+class PlanCase:
+    """一次数据库函数调用及其对执行计划和耗时的要求"""
+
+    def __init__(self, name, call, expect=(), allow_scans=(), allow_temp_sort=False, max_ms=50, repeat=3):
+        self.name = name
+        self.call = call
+        self.expect = [re.compile(pattern) for pattern in expect]
+        self.allow_scans = set(allow_scans)
+        self.allow_temp_sort = allow_temp_sort
+        self.max_ms = max_ms
+        self.repeat = repeat
+
+def seed_database(path):
+    """写入检查用的数据"""
+    from cinema_facets import rebuild_facets
+
+    random.seed(42)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.executemany(
+        'INSERT INTO users (username, password) VALUES (?, ?)',
+        ((f'user_{i}', 'pbkdf2:sha256:600000$seed$hash') for i in range(SEED_USERS))
+    )
+    cursor.executemany(
+        '''INSERT INTO cinemas (name, address, price, tags, created_at, updated_at)
+        VALUES (?, ?, ?, ?, datetime('2025-01-01', ?), datetime('2025-01-01', ?))''',
+        ((
+            f'{random.choice(["万达", "博纳", "星美", "CGV"])}影城{i}',
+            f'测试路{i}号',
+            round(random.uniform(10, 200), 1),
+            '[' + ', '.join(f'"{tag}"' for tag in random.sample(SEED_TAGS, 3)) + ']',
+            f'+{i} minutes',
+            f'+{i} minutes'
+        ) for i in range(SEED_CINEMAS))
+    )
+    cursor.executemany(
+        "INSERT INTO swapper_images (imageURL, created_at) VALUES (?, datetime('2025-01-01', ?))",
+        ((f'uploads/swapper/seed_{i}.jpg', f'+{i} minutes') for i in range(SEED_SWAPPER_IMAGES))
+    )
+    rebuild_facets(cursor)
+    conn.commit()
+    conn.close()
+
+def build_cases():
+    import models
+    import cinemas
+    import swapper_images
+
+    return [
+        PlanCase('get_user_by_username', lambda: models.get_user_by_username('user_4000'),
+                 expect=[r'SEARCH users USING (COVERING )?INDEX sqlite_autoindex_users_1']),
+        PlanCase('user_exists', lambda: models.user_exists('user_4000'),
+                 expect=[r'SEARCH users USING (COVERING )?INDEX sqlite_autoindex_users_1']),
+        PlanCase('add_user', lambda: models.add_user(f'plan_{time.time_ns()}', 'hash'), repeat=1),
+
+        PlanCase('get_all_cinemas', lambda: cinemas.get_all_cinemas(),
+                 expect=[r'SCAN cinemas USING INDEX idx_cinemas_created_at'], max_ms=400),
+        PlanCase('get_all_cinemas(分页)', lambda: cinemas.get_all_cinemas(20, 1000),
+                 expect=[r'SCAN cinemas USING INDEX idx_cinemas_created_at'], max_ms=20),
+        PlanCase('get_cinema_by_id', lambda: cinemas.get_cinema_by_id(12345),
+                 expect=[r'SEARCH cinemas USING INTEGER PRIMARY KEY']),
+        PlanCase('get_cinemas_by_ids', lambda: cinemas.get_cinemas_by_ids([12345, 100, 7, 19999]),
+                 expect=[r'SEARCH cinemas USING INTEGER PRIMARY KEY']),
+        # 关键字是 %kw% 子串匹配，无法使用索引，仅限制耗时
+        PlanCase('search_cinemas(keyword)', lambda: cinemas.search_cinemas(keyword='万达'),
+                 allow_scans={'cinemas'}, allow_temp_sort=True, max_ms=300),
+        PlanCase('search_cinemas(price)', lambda: cinemas.search_cinemas(min_price=50, max_price=55),
+                 expect=[r'cinemas USING INDEX idx_cinemas_(price|created_at)'], allow_temp_sort=True, max_ms=100),
+        PlanCase('search_cinemas(tag)', lambda: cinemas.search_cinemas(tag='IMAX'),
+                 expect=[r'cinema_tags USING (COVERING )?INDEX sqlite_autoindex_cinema_tags_1 \(tag=\?\)'],
+                 allow_temp_sort=True, max_ms=300),
+        # 聚合表本身很小（每个标签/分桶一行），允许扫描
+        PlanCase('get_cinema_facets', lambda: cinemas.get_cinema_facets(),
+                 allow_scans={'cinema_tag_counts', 'cinema_price_buckets'}, allow_temp_sort=True, max_ms=10),
+        PlanCase('get_cinema_facets(tag)', lambda: cinemas.get_cinema_facets(tag='IMAX'),
+                 expect=[r'cinema_tags USING (COVERING )?INDEX sqlite_autoindex_cinema_tags_1 \(tag=\?\)'],
+                 allow_scans={'t'}, allow_temp_sort=True, max_ms=300),
+        PlanCase('add_cinema', lambda: cinemas.add_cinema('检查影城', '检查路1号', 88, ['IMAX', '新标签']), repeat=1),
+        PlanCase('update_cinema', lambda: cinemas.update_cinema(100, price=99, tags=['3D', 'IMAX']),
+                 expect=[r'SEARCH cinemas USING INTEGER PRIMARY KEY',
+                         r'SEARCH cinema_tags USING (COVERING )?INDEX sqlite_autoindex_cinema_tags_1'], repeat=1),
+        PlanCase('delete_cinema', lambda: cinemas.delete_cinema(200),
+                 expect=[r'SEARCH cinemas USING INTEGER PRIMARY KEY'], repeat=1),
+
+        PlanCase('get_all_swapper_images', lambda: swapper_images.get_all_swapper_images(),
+                 expect=[r'SCAN swapper_images USING INDEX idx_swapper_images_created_at'], max_ms=50),
+        PlanCase('get_swapper_image_by_id', lambda: swapper_images.get_swapper_image_by_id(1000),
+                 expect=[r'SEARCH swapper_images USING INTEGER PRIMARY KEY']),
+        PlanCase('add_swapper_image', lambda: swapper_images.add_swapper_image('uploads/swapper/plan.jpg'), repeat=1),
+        PlanCase('delete_swapper_image', lambda: swapper_images.delete_swapper_image(1500),
+                 expect=[r'SEARCH swapper_images USING INTEGER PRIMARY KEY'], repeat=1),
+        PlanCase('get_swapper_images_after', lambda: swapper_images.get_swapper_images_after(1000, 200),
+                 expect=[r'SEARCH swapper_images USING INTEGER PRIMARY KEY \(rowid>\?\)']),
+        PlanCase('get_swapper_image_urls',
+                 lambda: swapper_images.get_swapper_image_urls([f'uploads/swapper/seed_{i}.jpg' for i in range(200)]),
+                 expect=[r'SEARCH swapper_images USING (COVERING )?INDEX idx_swapper_images_url \(imageURL=\?\)']),
+    ]
+
+def explain(conn, statement):
+    """返回语句执行计划的各行描述，无法解释时抛出sqlite3.Error"""
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {statement}')]
+
+def check_case(case, statements, elapsed_ms, conn):
+    """返回该用例的问题列表"""
+    problems = []
+    plans = []
+    for statement in statements:
+        try:
+            details = explain(conn, statement)
+        except sqlite3.Error as e:
+            # 无法检查的语句视为失败，避免没有expect的用例在未检查任何计划时通过
+            problems.append(f'无法解释执行计划({e}): {statement.strip()[:120]}')
+            continue
+        for detail in details:
+            plans.append(detail)
+            scan = FULL_SCAN.match(detail)
+            if scan and scan.group(1) not in case.allow_scans:
+                problems.append(f'全表扫描 {scan.group(1)}: {statement.strip()[:120]}')
+            if 'USE TEMP B-TREE' in detail and not case.allow_temp_sort:
+                problems.append(f'未使用索引排序: {statement.strip()[:120]}')
+
+    for pattern in case.expect:
+        if not any(pattern.search(detail) for detail in plans):
+            problems.append(f'执行计划中未找到 {pattern.pattern}')
+
+    if elapsed_ms > case.max_ms:
+        problems.append(f'耗时 {elapsed_ms:.1f}ms 超过上限 {case.max_ms}ms')
+
+    return problems
+
+def main():
+    os.chdir(tempfile.mkdtemp(prefix='qingwa_plans_'))
+
+    import database
+    statements = []
+    database.set_trace_callback(lambda statement: None if SKIPPED_STATEMENTS.match(statement) else statements.append(statement))
+
+    from models import init_db
+    from swapper_images import init_swapper_table
+    from cinemas import init_cinemas_table
+    init_db()
+    init_swapper_table()
+    init_cinemas_table()
+    seed_database(database.DATABASE_PATH)
+
+    conn = sqlite3.connect(database.DATABASE_PATH)
+    cases = build_cases()
+    failures = 0
+    for case in cases:
+        timings = []
+        for _ in range(case.repeat):
+            statements.clear()
+            start = time.perf_counter()
+            case.call()
+            timings.append((time.perf_counter() - start) * 1000)
+        elapsed_ms = min(timings)
+
+        problems = check_case(case, list(statements), elapsed_ms, conn)
+        status = 'OK  ' if not problems else 'FAIL'
+        print(f"[{status}] {case.name:<28}{elapsed_ms:>8.2f}ms  ({len(statements)} 条SQL)")
+        for problem in problems:
+            print(f"         - {problem}")
+        failures += bool(problems)
+
+    conn.close()
+    print(f"\n共 {len(cases)} 项检查，失败 {failures} 项")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+import cbor2
+import msgpack
+from flask import request, jsonify, Response
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+CBOR_MIMETYPE = 'application/cbor'
+
+# application/x-msgpack 是msgpack常见的非标准写法，同样支持
+_ENCODERS = {
+    MSGPACK_MIMETYPE: lambda payload: msgpack.packb(payload, use_bin_type=True),
+    'application/x-msgpack': lambda payload: msgpack.packb(payload, use_bin_type=True),
+    CBOR_MIMETYPE: cbor2.dumps,
+}
+
+def to_columnar(value):
+    """把字段相同的字典列表转换为按字段存放的数组，避免每条记录重复写键名
+
+    [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}] -> {'id': [1, 2], 'name': ['a', 'b']}
+    """
+    if isinstance(value, dict):
+        return {key: to_columnar(item) for key, item in value.items()}
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        keys = list(value[0])
+        if all(len(item) == len(keys) and all(key in item for key in keys) for item in value):
+            return {key: [to_columnar(item[key]) for item in value] for key in keys}
+    return value
+
+def api_response(payload, status=200):
+    """按Accept头返回JSON、MessagePack或CBOR
+
+    二进制格式下可用 ?layout=columnar 请求列式布局；未声明或同等偏好时返回JSON。
+    """
+    mimetype = request.accept_mimetypes.best_match([JSON_MIMETYPE, *_ENCODERS], default=JSON_MIMETYPE)
+
+    if mimetype == JSON_MIMETYPE:
+        response = jsonify(payload)
+    else:
+        if request.args.get('layout') == 'columnar':
+            payload = to_columnar(payload)
+        response = Response(_ENCODERS[mimetype](payload), mimetype=mimetype)
+
+    response.status_code = status
+    response.vary.add('Accept')
+    return response
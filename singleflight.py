@@ -0,0 +1,90 @@
+import inspect
+import threading
+from functools import wraps
+from database import get_write_generation
+
+class _Call:
+    """一次正在执行的调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """合并并发的相同调用：同一时刻相同参数的调用只执行一次，其余调用等待并共享结果
+
+    不缓存结果，调用结束后下一次调用会重新执行。
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def do(self, name, key, func):
+        with self._lock:
+            stats = self._stats.setdefault(name, {'calls': 0, 'executions': 0, 'coalesced': 0})
+            stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                stats['executions'] += 1
+            else:
+                stats['coalesced'] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self):
+        """各函数的调用次数、实际执行次数和被合并的次数"""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+# 进程内的全局合并器
+read_coalescer = SingleFlight()
+
+def _freeze(value):
+    """把参数转换为可哈希的形式，列表/字典参数按内容比较"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, set):
+        return tuple(sorted(_freeze(item) for item in value))
+    return value
+
+def coalesce(func):
+    """读函数装饰器：按规范化后的参数合并并发的相同调用
+
+    被合并的调用方拿到的是同一个结果对象，调用方不应修改返回值。
+    键中包含本进程的写入代数：写操作返回之后发起的调用不会加入写入之前开始的查询，
+    保证读到自己的写入。
+    """
+    signature = inspect.signature(func)
+    name = f'{func.__module__}.{func.__name__}'
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # 按参数名绑定并补全默认值，位置参数和关键字参数写法不同的调用也能合并
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (name, get_write_generation(), _freeze(tuple(bound.arguments.items())))
+        return read_coalescer.do(name, key, lambda: func(*args, **kwargs))
+
+    return wrapper
@@ -1,4 +1,7 @@
-from database import get_db_connection
+from database import get_db_connection, execute_write
+from image_hash import hash_index
+from singleflight import coalesce
+from file_delivery import normalize_upload_path
 import os
 import uuid
 from werkzeug.utils import secure_filename
@@ -19,6 +22,7 @@ def init_swapper_table():
                 CREATE TABLE swapper_images (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     imageURL TEXT NOT NULL,
+                    phash INTEGER,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
@@ -26,6 +30,18 @@ def init_swapper_table():
             print("swapper_images 表创建成功")
         else:
             print("swapper_images 表已存在")
+            # 旧表补充感知哈希列
+            cursor.execute("PRAGMA table_info(swapper_images)")
+            columns = [column['name'] for column in cursor.fetchall()]
+            if 'phash' not in columns:
+                print("swapper_images 表添加 phash 列...")
+                cursor.execute('ALTER TABLE swapper_images ADD COLUMN phash INTEGER')
+        
+        # 列表按创建时间倒序
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_swapper_images_created_at ON swapper_images (created_at)')
+        # 上传目录对账时按文件路径查找记录
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_swapper_images_url ON swapper_images (imageURL)')
+        conn.commit()
             
         conn.close()
         return True
@@ -33,23 +49,16 @@ def init_swapper_table():
         print(f"初始化swapper表失败: {str(e)}")
         return False
 
-def add_swapper_image(image_url):
+def add_swapper_image(image_url, phash=None):
     """添加swapper图像记录"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            'INSERT INTO swapper_images (imageURL) VALUES (?)',
-            (image_url,)
-        )
-        conn.commit()
-        image_id = cursor.lastrowid
-        conn.close()
-        return image_id
-    except Exception as e:
-        conn.close()
-        raise e
+    result = execute_write(
+        'INSERT INTO swapper_images (imageURL, phash) VALUES (?, ?)',
+        (image_url, phash)
+    )
+    hash_index.add(result.lastrowid, phash)
+    return result.lastrowid
 
+@coalesce
 def get_all_swapper_images():
     """获取所有swapper图像"""
     conn = get_db_connection()
@@ -70,33 +79,56 @@ def get_all_swapper_images():
     return image_list
 
 def delete_swapper_image(image_id):
-    """删除swapper图像"""
+    """删除swapper图像
+
+    先删文件再删记录：中途失败最多留下一条文件缺失的记录（对账时可发现并清理），
+    不会留下无记录的孤立文件。文件删除失败时抛出异常，记录保持不变。
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
-    
-    # 先获取图片URL以便删除文件
     cursor.execute('SELECT imageURL FROM swapper_images WHERE id = ?', (image_id,))
     image = cursor.fetchone()
+    conn.close()
     
-    if image:
-        image_url = image['imageURL']
-        # 删除数据库记录
-        cursor.execute('DELETE FROM swapper_images WHERE id = ?', (image_id,))
-        conn.commit()
-        conn.close()
-        
-        # 删除物理文件
-        try:
-            if os.path.exists(image_url):
-                os.remove(image_url)
-        except Exception as e:
-            print(f"删除文件失败: {str(e)}")
-        
-        return True
-    else:
-        conn.close()
+    if not image:
         return False
+    
+    # 删除物理文件，文件已不存在时视为已删除
+    try:
+        os.remove(normalize_upload_path(image['imageURL']))
+    except FileNotFoundError:
+        pass
+    
+    # 删除数据库记录
+    result = execute_write('DELETE FROM swapper_images WHERE id = ?', (image_id,))
+    hash_index.remove(image_id)
+    return result.rowcount > 0
+
+def get_swapper_images_after(last_id, limit):
+    """按ID顺序分批读取图像记录（对账用）"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        'SELECT id, imageURL FROM swapper_images WHERE id > ? ORDER BY id LIMIT ?',
+        (last_id, limit)
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return [{'id': row['id'], 'imageURL': row['imageURL']} for row in rows]
+
+def get_swapper_image_urls(image_urls):
+    """返回给定路径中在数据库里有记录的路径集合（对账用）"""
+    if not image_urls:
+        return set()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ','.join('?' * len(image_urls))
+    cursor.execute(f'SELECT imageURL FROM swapper_images WHERE imageURL IN ({placeholders})', list(image_urls))
+    rows = cursor.fetchall()
+    conn.close()
+    return {row['imageURL'] for row in rows}
 
+@coalesce
 def get_swapper_image_by_id(image_id):
     """根据ID获取swapper图像"""
     conn = get_db_connection()
@@ -0,0 +1,232 @@
+"""上传目录与swapper_images表的增量对账
+
+分两个阶段分批扫描，每批结束后把游标写入状态文件，中断后从游标处继续：
+    rows  按ID顺序检查记录对应的文件是否存在，找出文件缺失的记录
+    files 按文件名顺序检查上传目录中的文件是否有记录，找出孤立文件并统计磁盘占用
+          （每轮只在进入该阶段时列一次目录，排序后的文件名保存在内存中，按游标分批处理）
+文件操作按速率上限限速，批次之间休眠，适合与服务同时长期运行。
+
+用法:
+    python upload_reconciler.py run [--delete] [--continuous]
+    python upload_reconciler.py status
+    python upload_reconciler.py reset
+默认只报告；--delete 时删除孤立文件和文件缺失的记录。
+"""
+import bisect
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+from file_delivery import normalize_upload_path
+
+UPLOAD_FOLDER = 'uploads/swapper'
+STATE_PATH = 'upload_reconcile.json'
+RECONCILE_BATCH_SIZE = 200
+# 文件操作(stat/删除)速率上限(次/秒)，0表示不限速
+RECONCILE_IO_RATE = 500
+RECONCILE_BATCH_SLEEP = 0.05
+# 持续运行时两轮对账之间的间隔(秒)
+RECONCILE_PASS_INTERVAL = 300
+# 修改时间在该时间(秒)内的孤立文件可能是正在上传、尚未写入记录的文件，不删除
+ORPHAN_MIN_AGE = 3600
+# 报告中最多列出的孤立文件/缺失记录数
+REPORT_LIMIT = 100
+
+class Throttle:
+    """按速率上限均匀分配文件操作"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.started = time.monotonic()
+        self.count = 0
+
+    def wait(self):
+        self.count += 1
+        if self.rate:
+            expected = self.count / self.rate
+            elapsed = time.monotonic() - self.started
+            if expected > elapsed:
+                time.sleep(expected - elapsed)
+
+def _new_pass():
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'files': 0,
+        'bytes': 0,
+        'orphan_files': 0,
+        'orphan_bytes': 0,
+        'orphans': [],
+        'pending_orphans': 0,
+        'missing_rows': 0,
+        'missing': [],
+        'removed_files': 0,
+        'removed_rows': 0
+    }
+
+def load_state(path=STATE_PATH):
+    """读取对账状态，文件不存在或损坏时从头开始"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'phase': 'rows', 'last_id': 0, 'last_name': '', 'pass': _new_pass(), 'last_pass': None}
+
+def save_state(state, path=STATE_PATH):
+    """原子写入对账状态"""
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+# 每轮对账的目录列表 {(目录, 本轮开始时间): 排序后的文件名}，进程重启后重新列一次目录并从游标处继续
+_listings = {}
+
+def _pass_listing(state, folder):
+    key = (os.path.abspath(folder), state['pass']['started_at'])
+    names = _listings.get(key)
+    if names is None:
+        # 目录项只读文件名和类型，不做stat
+        with os.scandir(folder) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_file(follow_symlinks=False))
+        _listings.clear()
+        _listings[key] = names
+    return names
+
+def _report(items, item):
+    if len(items) < REPORT_LIMIT:
+        items.append(item)
+
+def _check_rows(state, delete, batch_size, throttle):
+    """检查一批记录，返回是否已检查完所有记录"""
+    from swapper_images import get_swapper_images_after, delete_swapper_image
+
+    current = state['pass']
+    rows = get_swapper_images_after(state['last_id'], batch_size)
+    for row in rows:
+        throttle.wait()
+        if not os.path.exists(normalize_upload_path(row['imageURL'])):
+            current['missing_rows'] += 1
+            _report(current['missing'], row)
+            if delete and delete_swapper_image(row['id']):
+                current['removed_rows'] += 1
+        state['last_id'] = row['id']
+    return len(rows) < batch_size
+
+def _check_files(state, folder, delete, batch_size, throttle):
+    """检查一批文件，返回是否已检查完所有文件"""
+    from swapper_images import get_swapper_image_urls
+
+    current = state['pass']
+    listing = _pass_listing(state, folder)
+    start = bisect.bisect_right(listing, state['last_name'])
+    names = listing[start:start + batch_size]
+
+    # 数据库中的路径可能是Windows下保存的反斜杠形式，两种写法都查
+    candidates = {}
+    for name in names:
+        for path in (f'{folder}/{name}', f'{folder}\\{name}'):
+            candidates[path] = name
+    referenced = {candidates[url] for url in get_swapper_image_urls(list(candidates))}
+
+    now = time.time()
+    for name in names:
+        state['last_name'] = name
+        throttle.wait()
+        try:
+            stat = os.stat(os.path.join(folder, name))
+        except FileNotFoundError:
+            continue
+        current['files'] += 1
+        current['bytes'] += stat.st_size
+        if name in referenced:
+            continue
+
+        if now - stat.st_mtime < ORPHAN_MIN_AGE:
+            current['pending_orphans'] += 1
+            continue
+        current['orphan_files'] += 1
+        current['orphan_bytes'] += stat.st_size
+        _report(current['orphans'], {'name': name, 'size': stat.st_size})
+        # 删除前再确认一次，避免与刚完成的上传冲突
+        if delete and not get_swapper_image_urls([f'{folder}/{name}', f'{folder}\\{name}']):
+            throttle.wait()
+            try:
+                os.remove(os.path.join(folder, name))
+                current['removed_files'] += 1
+            except FileNotFoundError:
+                pass
+    return len(names) < batch_size
+
+def reconcile_step(state, folder=UPLOAD_FOLDER, delete=False, batch_size=RECONCILE_BATCH_SIZE, throttle=None):
+    """执行一批对账并推进游标，返回本轮对账是否已完成"""
+    throttle = throttle or Throttle(RECONCILE_IO_RATE)
+    if state['phase'] == 'rows':
+        if _check_rows(state, delete, batch_size, throttle):
+            state['phase'] = 'files'
+        return False
+
+    if not _check_files(state, folder, delete, batch_size, throttle):
+        return False
+
+    finished = state['pass']
+    _listings.clear()
+    finished['finished_at'] = datetime.now().isoformat(timespec='seconds')
+    state.update({'phase': 'rows', 'last_id': 0, 'last_name': '', 'pass': _new_pass(), 'last_pass': finished})
+    return True
+
+def reconcile(folder=UPLOAD_FOLDER, delete=False, continuous=False, state_path=STATE_PATH,
+              batch_size=RECONCILE_BATCH_SIZE, rate=RECONCILE_IO_RATE):
+    """从上次的游标处继续对账，完成一轮后返回；continuous时每隔RECONCILE_PASS_INTERVAL秒开始新一轮"""
+    state = load_state(state_path)
+    throttle = Throttle(rate)
+    while True:
+        finished = reconcile_step(state, folder, delete, batch_size, throttle)
+        save_state(state, state_path)
+        if finished:
+            _print_pass(state['last_pass'])
+            if not continuous:
+                return state['last_pass']
+            time.sleep(RECONCILE_PASS_INTERVAL)
+            throttle = Throttle(rate)
+        else:
+            time.sleep(RECONCILE_BATCH_SLEEP)
+
+def reconcile_status(folder=UPLOAD_FOLDER, state_path=STATE_PATH):
+    """上传目录的磁盘占用和对账进度"""
+    state = load_state(state_path)
+    disk = shutil.disk_usage(folder)
+    return {
+        'phase': state['phase'],
+        'cursor': {'last_id': state['last_id'], 'last_name': state['last_name']},
+        'current_pass': state['pass'],
+        'last_pass': state['last_pass'],
+        'disk': {'total': disk.total, 'used': disk.used, 'free': disk.free}
+    }
+
+def _print_pass(summary):
+    print(f"对账完成: 文件 {summary['files']} 个，共 {summary['bytes'] / 1024 / 1024:.1f}MB；"
+          f"孤立文件 {summary['orphan_files']} 个 ({summary['orphan_bytes'] / 1024 / 1024:.1f}MB)，"
+          f"新近未入库 {summary['pending_orphans']} 个；文件缺失的记录 {summary['missing_rows']} 条；"
+          f"已删除文件 {summary['removed_files']} 个，记录 {summary['removed_rows']} 条")
+    for orphan in summary['orphans']:
+        print(f"  孤立文件: {orphan['name']} ({orphan['size']} 字节)")
+    for row in summary['missing']:
+        print(f"  文件缺失: id={row['id']} {row['imageURL']}")
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'run':
+        from swapper_images import init_swapper_table
+        init_swapper_table()
+        reconcile(delete='--delete' in sys.argv[2:], continuous='--continuous' in sys.argv[2:])
+    elif command == 'status':
+        print(json.dumps(reconcile_status(), ensure_ascii=False, indent=2))
+    elif command == 'reset':
+        if os.path.exists(STATE_PATH):
+            os.remove(STATE_PATH)
+        print("对账进度已重置")
+    else:
+        print(__doc__)
+        sys.exit(1)